@@ -1,159 +1,140 @@
 # command-line conversational agent
-from langchain_core.tools import tool
-from langchain.agents import AgentExecutor, create_react_agent
-from langchain_community.chat_models import ChatAnthropic
-from langchain_core.prompts import PromptTemplate
-import psycopg2
-from pgvector.psycopg2 import register_vector
-from sentence_transformers import SentenceTransformer
 import os
+import threading
 from dotenv import load_dotenv
+import db
+from embeddings import describe_model, encode_query, format_cache_stats, get_model
+from retrieval import Page, decode_cursor, encode_cursor, parse_filters, extract_keywords, hybrid_search
+from timing import configure_logging, trace
 
 load_dotenv()
-
-# Load models
-print("Loading models...")
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-print("[OK] Embedding model loaded")
-
-llm = ChatAnthropic(
-    model=os.getenv('ANTHROPIC_MODEL', 'claude-3-5-sonnet-20241022'),
-    anthropic_api_key=os.getenv('ANTHROPIC_API_KEY'),
-    temperature=0
-)
-print("[OK] Claude API connected\n")
+configure_logging()
 
 # ============================================
-# TOOLS (using @tool decorator)
+# TOOLS (wrapped as LangChain tools in get_agent_executor)
 # ============================================
 
-@tool
+SUMMARY_CHARS = 200  # search_blog only shows a snippet, truncated server-side
+
+def search_blog_results(query, limit=3):
+    """Hybrid retrieval and fusion (FUSION_METHOD) as in the web UI, without MMR diversification"""
+    query, filters = parse_filters(query)
+    with trace('search_blog', query=query):
+        query_embedding = encode_query(get_model(), query)
+        with db.cursor() as cur:
+            return hybrid_search(cur, query_embedding, extract_keywords(query), limit, filters,
+                                 content_chars=SUMMARY_CHARS)
+
 def search_blog(query: str) -> str:
-    """Search blog posts for relevant content. Input should be a search query like 'SQL Server performance' or 'RCSI'."""
+    """Search blog posts for relevant content. Input should be a search query like 'SQL Server performance' or 'RCSI'. Optionally narrow it with source:servicenow, after:YYYY-MM-DD or before:YYYY-MM-DD."""
     
-    conn = psycopg2.connect(
-        host=os.getenv('DB_HOST'),
-        database=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        port=os.getenv('DB_PORT')
-    )
-    register_vector(conn)
-    cur = conn.cursor()
-    
-    query_embedding = embedding_model.encode(query).tolist()
-    
-    cur.execute('''
-        SELECT title, content, url
-        FROM sql_docs
-        ORDER BY embedding <=> %s::vector
-        LIMIT 3
-    ''', (query_embedding,))
-    
-    results = cur.fetchall()
-    cur.close()
-    conn.close()
+    results = search_blog_results(query)
     
     if not results:
         return "No relevant blog posts found."
     
     output = "Found these blog posts:\n\n"
-    for i, (title, content, url) in enumerate(results, 1):
-        output += f"{i}. {title}\n"
-        output += f"   Summary: {content[:200]}...\n"
-        output += f"   URL: {url}\n\n"
+    for i, r in enumerate(results, 1):
+        output += f"{i}. {r.title}\n"
+        output += f"   Summary: {r.content}...\n"
+        output += f"   URL: {r.url}\n\n"
     
     return output
 
-@tool
 def count_posts(topic: str = "") -> str:
     """Count blog posts. Input can be a topic (e.g. 'RCSI') or leave empty for total count."""
     
-    conn = psycopg2.connect(
-        host=os.getenv('DB_HOST'),
-        database=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        port=os.getenv('DB_PORT')
-    )
-    cur = conn.cursor()
-    
-    if topic:
-        cur.execute("""
-            SELECT COUNT(*) 
-            FROM sql_docs 
-            WHERE title ILIKE %s OR content ILIKE %s
-        """, (f'%{topic}%', f'%{topic}%'))
-        count = cur.fetchone()[0]
-        result = f"Found {count} blog posts about '{topic}'."
-    else:
-        cur.execute("SELECT COUNT(*) FROM sql_docs")
-        count = cur.fetchone()[0]
-        result = f"Total blog posts: {count}"
+    with db.cursor() as cur:
+        if topic:
+            cur.execute("""
+                SELECT COUNT(*) 
+                FROM sql_docs 
+                WHERE title ILIKE %s OR content ILIKE %s
+            """, (f'%{topic}%', f'%{topic}%'))
+            count = cur.fetchone()[0]
+            result = f"Found {count} blog posts about '{topic}'."
+        else:
+            cur.execute("SELECT COUNT(*) FROM sql_docs")
+            count = cur.fetchone()[0]
+            result = f"Total blog posts: {count}"
     
-    cur.close()
-    conn.close()
     return result
 
-@tool
+def recent_posts(limit, cursor=None):
+    """Newest documents first and undated ones last, keyset-paginated on (created_at, id); returns a Page of rows
+
+    Dated rows after the cursor, then undated rows (created_at IS NULL) by id: each part is one range
+    scan of idx_sql_docs_created_at starting at the cursor, however deep it is. A cursor with no date
+    resumes inside the undated rows.
+    """
+    dated = ('created_at IS NOT NULL', [])
+    undated = ('created_at IS NULL', [])
+    if cursor is not None and cursor[0] is not None:
+        dated = ('(created_at, id) < (%s::timestamp, %s::integer)', list(cursor))
+    elif cursor is not None:
+        dated = None
+        undated = ('created_at IS NULL AND id < %s::integer', [cursor[1]])
+    parts = [part for part in (dated, undated) if part is not None]
+    branches = ' UNION ALL '.join(f"""
+            (SELECT title, url, created_at, id
+             FROM sql_docs
+             WHERE {condition}
+             ORDER BY created_at DESC NULLS LAST, id DESC
+             LIMIT %s)""" for condition, _ in parts)
+    with db.cursor() as cur:
+        # Both branches come out of the index in this order, so the merge stops after limit + 1 rows
+        cur.execute(f"""
+            SELECT title, url, created_at, id
+            FROM ({branches}) recent
+            ORDER BY created_at DESC NULLS LAST, id DESC
+            LIMIT %s
+        """, [param for _, params in parts for param in params + [limit + 1]] + [limit + 1])
+        rows = cur.fetchall()
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = (last[2].isoformat() if last[2] is not None else None, last[3])
+    else:
+        next_cursor = None
+    return Page(rows[:limit], next_cursor)
+
 def list_recent(limit: str = "5") -> str:
-    """List recent blog posts. Input should be number of posts like '5' or '10'."""
+    """List recent blog posts. Input should be number of posts like '5' or '10'. To see older posts, pass the number followed by the 'more' token from the previous answer, like '5 eyJ...'."""
     
+    parts = limit.split()
     try:
-        limit_int = int(limit)
-    except:
+        limit_int = int(parts[0])
+    except (IndexError, ValueError):
         limit_int = 5
+    try:
+        cursor = decode_cursor(parts[1]) if len(parts) > 1 else None
+    except ValueError:
+        return "Invalid 'more' token; call list_recent with just a number to start from the newest posts."
     
-    conn = psycopg2.connect(
-        host=os.getenv('DB_HOST'),
-        database=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        port=os.getenv('DB_PORT')
-    )
-    cur = conn.cursor()
-    
-    cur.execute("""
-        SELECT title, url, created_at 
-        FROM sql_docs 
-        ORDER BY created_at DESC 
-        LIMIT %s
-    """, (limit_int,))
-    
-    results = cur.fetchall()
-    cur.close()
-    conn.close()
+    results, next_cursor = recent_posts(limit_int, cursor)
     
     if not results:
         return "No posts found."
     
-    output = f"Most recent {len(results)} posts:\n\n"
-    for i, (title, url, created_at) in enumerate(results, 1):
-        output += f"{i}. {title}\n   Date: {created_at}\n   URL: {url}\n\n"
+    output = f"{'Next' if cursor else 'Most recent'} {len(results)} posts:\n\n"
+    for i, (title, url, created_at, _) in enumerate(results, 1):
+        output += f"{i}. {title}\n   Date: {created_at or 'unknown'}\n   URL: {url}\n\n"
+    if next_cursor:
+        output += f"More: call list_recent with '{limit_int} {encode_cursor(next_cursor)}'\n"
     
     return output
 
-@tool
 def get_stats() -> str:
     """Get blog statistics: total posts, date range, and top topics. No input needed."""
     
-    conn = psycopg2.connect(
-        host=os.getenv('DB_HOST'),
-        database=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        port=os.getenv('DB_PORT')
-    )
-    cur = conn.cursor()
-    
-    cur.execute("SELECT COUNT(*) FROM sql_docs")
-    total = cur.fetchone()[0]
-    
-    cur.execute("SELECT MIN(created_at), MAX(created_at) FROM sql_docs")
-    min_date, max_date = cur.fetchone()
-    
-    cur.execute("SELECT title FROM sql_docs")
-    titles = [row[0].lower() for row in cur.fetchall()]
+    with db.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM sql_docs")
+        total = cur.fetchone()[0]
+        
+        cur.execute("SELECT MIN(created_at), MAX(created_at) FROM sql_docs")
+        min_date, max_date = cur.fetchone()
+        
+        cur.execute("SELECT title FROM sql_docs")
+        titles = [row[0].lower() for row in cur.fetchall()]
     
     keywords = {
         'sql server': 0, 'performance': 0, 'index': 0, 
@@ -168,9 +149,6 @@ def get_stats() -> str:
     
     top_topics = sorted(keywords.items(), key=lambda x: x[1], reverse=True)[:5]
     
-    cur.close()
-    conn.close()
-    
     output = f"📊 Blog Statistics:\n\n"
     output += f"Total Posts: {total}\n"
     output += f"Date Range: {min_date.strftime('%Y-%m-%d')} to {max_date.strftime('%Y-%m-%d')}\n\n"
@@ -182,11 +160,9 @@ def get_stats() -> str:
     return output
 
 # ============================================
-# Create Agent
+# Create Agent (on first use: LangChain, the Claude client and torch are only imported when needed)
 # ============================================
 
-tools = [search_blog, count_posts, list_recent, get_stats]
-
 template = """Answer the following questions as best you can. You have access to the following tools:
 
 {tools}
@@ -207,16 +183,44 @@ Begin!
 Question: {input}
 Thought: {agent_scratchpad}"""
 
-prompt = PromptTemplate.from_template(template)
+_agent_executor = None
+_agent_lock = threading.Lock()
+
+
+def get_agent_executor():
+    global _agent_executor
+    if _agent_executor is None:
+        with _agent_lock:
+            if _agent_executor is None:
+                _agent_executor = build_agent_executor()
+    return _agent_executor
+
+
+def build_agent_executor():
+    from langchain_core.tools import tool
+    from langchain.agents import AgentExecutor, create_react_agent
+    from langchain_community.chat_models import ChatAnthropic
+    from langchain_core.prompts import PromptTemplate
 
-agent = create_react_agent(llm, tools, prompt)
-agent_executor = AgentExecutor(
-    agent=agent,
-    tools=tools,
-    verbose=True,
-    handle_parsing_errors=True,
-    max_iterations=5
-)
+    print("Loading agent...")
+    llm = ChatAnthropic(
+        model=os.getenv('ANTHROPIC_MODEL', 'claude-3-5-sonnet-20241022'),
+        anthropic_api_key=os.getenv('ANTHROPIC_API_KEY'),
+        temperature=0
+    )
+    print("[OK] Claude API connected\n")
+
+    tools = [tool(f) for f in (search_blog, count_posts, list_recent, get_stats)]
+    prompt = PromptTemplate.from_template(template)
+
+    agent = create_react_agent(llm, tools, prompt)
+    return AgentExecutor(
+        agent=agent,
+        tools=tools,
+        verbose=True,
+        handle_parsing_errors=True,
+        max_iterations=5
+    )
 
 # ============================================
 # Interactive Loop
@@ -244,6 +248,9 @@ if __name__ == "__main__":
         user_input = input("You: ").strip()
         
         if user_input.lower() in ['quit', 'exit', 'q']:
+            print(f"\n{db.format_pool_stats()}")
+            print(describe_model())
+            print(format_cache_stats())
             print("\n👋 Goodbye!")
             break
         
@@ -253,7 +260,7 @@ if __name__ == "__main__":
         print("\n🤖 Agent is thinking...\n")
         
         try:
-            response = agent_executor.invoke({"input": user_input})
+            response = get_agent_executor().invoke({"input": user_input})
             print(f"\n✅ Agent: {response['output']}")
         except Exception as e:
             print(f"\n❌ Error: {e}")
@@ -0,0 +1,226 @@
+# Fast path for aggregate questions ("How many times have we had tempdb issues?")
+#
+# Counting and listing questions are answered from SQL over sql_docs instead of top-k retrieval and a
+# Claude call: a top-6 search cannot count, and the answer is a template over the exact numbers.
+#
+#   intent = detect_intent("How many tempdb incidents in the last 6 months?")
+#   answer_aggregate(intent)  ->  "**3** ServiceNow incidents mentioning tempdb since 2024-05-01 ..."
+#
+# Topic words are matched with ILIKE on title and content (trigram indexes from setup_db.py) and the
+# matches are counted per source and month, so one statement answers "how many" and "when".
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta
+import os
+from dotenv import load_dotenv
+import db
+from retrieval import SearchFilters, extract_keywords, filter_clause
+from timing import span
+
+load_dotenv()
+
+AGGREGATE_FAST_PATH = os.getenv('AGGREGATE_FAST_PATH', 'true').lower() == 'true'
+LIST_LIMIT = 10          # documents listed for "list ..." questions
+EXAMPLES_LIMIT = 3       # most recent matches shown under a count
+
+AggregateIntent = namedtuple('AggregateIntent', ['kind', 'keywords', 'filters'])
+
+SOURCE_NAMES = {
+    'servicenow': ('ServiceNow incident', 'ServiceNow incidents'),
+    'documentation': ('runbook', 'runbooks'),
+    'blog': ('blog post', 'blog posts'),
+    'microsoft': ('Microsoft Docs article', 'Microsoft Docs articles'),
+}
+
+# Words naming a source (the countable entity); "how many times have we had ..." is about incidents
+_SOURCE_WORDS = [
+    ('servicenow', re.compile(r'\b(incidents?|outages?|tickets?|rcas?|problem records?|times (?:have )?we(?: have)? had)\b', re.I)),
+    ('documentation', re.compile(r'\b(runbooks?|playbooks?)\b', re.I)),
+    ('blog', re.compile(r'\b(blog posts?|posts?|articles? (?:i|we) wrote)\b', re.I)),
+    ('microsoft', re.compile(r'\b(microsoft docs?|ms docs?)\b', re.I)),
+]
+
+_COUNT = re.compile(r'\b(how many|how often|number of|count (?:of|the|all)?)\b', re.I)
+_LIST = re.compile(r'^\s*(?:list|enumerate|show (?:me )?all|which (?:incidents|runbooks|posts|articles)'
+                   r'|what (?:incidents|runbooks|posts|articles))\b', re.I)
+
+# "How many ... should I / how do I count ..." asks for advice, not for a number from the corpus
+_ADVICE = re.compile(r'\b(should|how (?:do|can|would) (?:i|we|you)|how to)\b', re.I)
+
+_LAST_N = re.compile(r'\b(?:in |over |during )?the (?:last|past) (\d+) (day|week|month|year)s?\b', re.I)
+_LAST_ONE = re.compile(r'\b(?:in |over |during )?(?:the )?(?:last|past) (day|week|month|year)\b', re.I)
+_THIS = re.compile(r'\bthis (week|month|year)\b', re.I)
+_SINCE = re.compile(r'\bsince (\d{4}-\d{2}-\d{2})\b', re.I)
+_IN_YEAR = re.compile(r'\b(?:in|during) (\d{4})\b', re.I)
+UNIT_DAYS = {'day': 1, 'week': 7, 'month': 30, 'year': 365}
+
+# Words that describe the question rather than its topic
+NON_TOPIC_WORDS = {
+    'times', 'time', 'had', 'has', 'there', 'were', 'was', 'did', 'often', 'number', 'count', 'list', 'all',
+    'show', 'which', 'issues', 'issue', 'problems', 'problem', 'incidents', 'incident', 'outages', 'outage',
+    'tickets', 'ticket', 'records', 'record', 'rcas', 'rca', 'runbooks', 'runbook', 'playbooks', 'procedures',
+    'posts', 'post', 'blog', 'articles', 'article', 'docs', 'doc', 'documents', 'microsoft', 'past', 'last',
+    'since', 'during', 'over', 'days', 'day', 'weeks', 'week', 'months', 'month', 'years', 'year', 'wrote',
+    'mention', 'mentioned', 'related', 'involving', 'enumerate',
+}
+
+
+def parse_time_range(question, now=None):
+    """created_after / created_before implied by phrases like 'last 30 days', 'this month', 'in 2024'"""
+    now = now or datetime.now()
+    if match := _LAST_N.search(question):
+        return now - timedelta(days=int(match.group(1)) * UNIT_DAYS[match.group(2).lower()]), None
+    if match := _LAST_ONE.search(question):
+        return now - timedelta(days=UNIT_DAYS[match.group(1).lower()]), None
+    if match := _THIS.search(question):
+        unit = match.group(1).lower()
+        if unit == 'week':
+            start = now - timedelta(days=now.weekday())
+        else:
+            start = now.replace(day=1) if unit == 'month' else now.replace(month=1, day=1)
+        return start.replace(hour=0, minute=0, second=0, microsecond=0), None
+    if match := _SINCE.search(question):
+        return datetime.strptime(match.group(1), '%Y-%m-%d'), None
+    if match := _IN_YEAR.search(question):
+        year = int(match.group(1))
+        return datetime(year, 1, 1), datetime(year + 1, 1, 1)
+    return None, None
+
+
+def strip_time_phrases(question):
+    for pattern in (_LAST_N, _LAST_ONE, _THIS, _SINCE, _IN_YEAR):
+        question = pattern.sub(' ', question)
+    return question
+
+
+def detect_intent(question, filters=None):
+    """AggregateIntent for counting / listing questions, or None to answer by retrieval
+
+    `filters` are the inline filters already parsed out of the question (retrieval.parse_filters);
+    sources and dates named in the question narrow them further.
+
+    Counting or listing phrasing alone is not enough: the question must name what to count, a
+    source or document type ("incidents", "runbooks", "times we had ..."), or carry a source
+    filter, which also scopes the count to that source. These stay with search_docs:
+        How often should I rebuild indexes?
+        How do I count rows in a large table quickly?
+        How many data files should tempdb have?
+        list the steps to fail over an AG
+    """
+    if not AGGREGATE_FAST_PATH or _ADVICE.search(question):
+        return None
+    if _COUNT.search(question):
+        kind = 'count'
+    elif _LIST.search(question):
+        kind = 'list'
+    else:
+        return None
+
+    sources = list(filters.sources) if filters is not None and filters.sources else []
+    if not sources:
+        sources = [source for source, pattern in _SOURCE_WORDS if pattern.search(question)]
+    if not sources:
+        return None  # no countable entity: "how many data files", "list the steps"
+    created_after, created_before = parse_time_range(question)
+    if filters is not None:
+        created_after = max(filter(None, (created_after, filters.created_after)), default=None)
+        created_before = min(filter(None, (created_before, filters.created_before)), default=None)
+
+    keywords = [k for k in extract_keywords(strip_time_phrases(question)) if k not in NON_TOPIC_WORDS]
+    return AggregateIntent(kind, keywords, SearchFilters(sources, created_after, created_before))
+
+
+def topic_clause(keywords):
+    """Every topic word must appear in the title or the content (trigram-indexed ILIKE)"""
+    if not keywords:
+        return 'TRUE', []
+    conditions = ' AND '.join(['(title ILIKE %s OR content ILIKE %s)'] * len(keywords))
+    return conditions, [pattern for k in keywords for pattern in (f'%{k}%', f'%{k}%')]
+
+
+def count_by_source_and_month(cur, keywords, filters):
+    """[(source, month, count)] of the matching documents"""
+    topic, topic_params = topic_clause(keywords)
+    where, filter_params = filter_clause(filters)
+    db.execute_prepared(cur, f'''
+        SELECT source, date_trunc('month', created_at)::date AS month, COUNT(*)
+        FROM sql_docs
+        WHERE {topic} AND {where}
+        GROUP BY source, month
+        ORDER BY source, month
+    ''', topic_params + filter_params)
+    return cur.fetchall()
+
+
+def latest_matches(cur, keywords, filters, limit):
+    """[(title, url, source, created_at)] of the most recent matching documents"""
+    topic, topic_params = topic_clause(keywords)
+    where, filter_params = filter_clause(filters)
+    db.execute_prepared(cur, f'''
+        SELECT title, url, source, created_at
+        FROM sql_docs
+        WHERE {topic} AND {where}
+        ORDER BY created_at DESC NULLS LAST, id DESC
+        LIMIT %s
+    ''', topic_params + filter_params + [limit])
+    return cur.fetchall()
+
+
+def source_name(source, count):
+    singular, plural = SOURCE_NAMES.get(source, (f'{source} document', f'{source} documents'))
+    return singular if count == 1 else plural
+
+
+def describe_scope(intent):
+    parts = []
+    if intent.keywords:
+        parts.append(f"mentioning {' '.join(intent.keywords)}")
+    if intent.filters.created_after:
+        parts.append(f"since {intent.filters.created_after:%Y-%m-%d}")
+    if intent.filters.created_before:
+        parts.append(f"before {intent.filters.created_before:%Y-%m-%d}")
+    return ' '.join(parts)
+
+
+def format_matches(matches):
+    return '\n'.join(f"- {created_at:%Y-%m-%d} · [{title}]({url})" if created_at else f"- [{title}]({url})"
+                     for title, url, _, created_at in matches)
+
+
+def answer_aggregate(intent):
+    """Markdown answer for an AggregateIntent, from two indexed queries"""
+    with span('aggregate', kind=intent.kind, keywords=len(intent.keywords)) as fields, db.cursor() as cur:
+        if intent.kind == 'list':
+            matches = latest_matches(cur, intent.keywords, intent.filters, LIST_LIMIT)
+            fields['rows'] = len(matches)
+            sources = intent.filters.sources or []
+            kind = source_name(sources[0], len(matches)) if len(sources) == 1 else 'documents'
+            heading = ' '.join(filter(None, [kind, describe_scope(intent)]))
+            if not matches:
+                return f"No {heading} found."
+            return f"Most recent {len(matches)} {heading}:\n\n{format_matches(matches)}"
+
+        counts = count_by_source_and_month(cur, intent.keywords, intent.filters)
+        matches = latest_matches(cur, intent.keywords, intent.filters, EXAMPLES_LIMIT) if counts else []
+        fields['rows'] = len(counts)
+
+    scope = describe_scope(intent)
+    if not counts:
+        sources = ', '.join(source_name(s, 2) for s in intent.filters.sources or []) or 'documents'
+        return f"**0** {' '.join(filter(None, [sources, scope]))}."
+
+    per_source = {}
+    per_month = {}
+    for source, month, count in counts:
+        per_source[source] = per_source.get(source, 0) + count
+        per_source_months = per_month.setdefault(source, [])
+        if month is not None:
+            per_source_months.append(f"{month:%b %Y}: {count}")
+
+    lines = []
+    for source, total in sorted(per_source.items(), key=lambda item: item[1], reverse=True):
+        months = per_month[source]
+        line = f"**{total}** {source_name(source, total)} {scope}".rstrip()
+        lines.append(f"- {line}" + (f" ({', '.join(months)})" if months and len(months) <= 12 else ''))
+    answer = '\n'.join(lines) if len(lines) > 1 else lines[0][2:]
+    return f"{answer}\n\nMost recent:\n{format_matches(matches)}"
@@ -0,0 +1,110 @@
+# Semantic answer cache for Claude answers, persisted in Postgres
+#
+# An answer is reused when a new question's embedding is within ANSWER_CACHE_THRESHOLD
+# cosine similarity of a cached question AND retrieval returned the same set of documents.
+import threading
+import os
+from dotenv import load_dotenv
+import db
+from timing import span
+
+load_dotenv()
+
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'true').lower() == 'true'
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.95'))
+ANSWER_CACHE_MAX_AGE_DAYS = int(os.getenv('ANSWER_CACHE_MAX_AGE_DAYS', '30'))
+
+CREATE_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS public.answer_cache
+    (
+        id serial PRIMARY KEY,
+        question text NOT NULL,
+        question_embedding vector(384) NOT NULL,
+        doc_ids integer[] NOT NULL,
+        answer text NOT NULL,
+        model text NOT NULL,
+        created_at timestamp without time zone DEFAULT CURRENT_TIMESTAMP,
+        hit_count integer NOT NULL DEFAULT 0,
+        last_hit_at timestamp without time zone
+    );
+    CREATE INDEX IF NOT EXISTS idx_answer_cache_doc_ids
+        ON public.answer_cache USING btree (doc_ids, model);
+'''
+
+_table_ready = False
+_stats_lock = threading.Lock()
+_hits = 0
+_lookups = 0
+
+
+def ensure_table():
+    global _table_ready
+    if not _table_ready:
+        with db.cursor() as cur:
+            cur.execute(CREATE_TABLE_SQL)
+        _table_ready = True
+
+
+def lookup(question_embedding, doc_ids, model):
+    """Cached answer for a similar question over the same documents, or None"""
+    global _hits, _lookups
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    ensure_table()
+
+    with span('db.answer_cache_lookup') as fields, db.cursor() as cur:
+        # The exact doc_ids match narrows the candidates to a handful of rows before the distance sort
+        db.execute_prepared(cur, '''
+            SELECT id, answer, question_embedding <=> %s::vector AS distance
+            FROM answer_cache
+            WHERE doc_ids = %s::integer[]
+              AND model = %s::text
+              AND created_at > NOW() - make_interval(days => %s::integer)
+            ORDER BY distance
+            LIMIT 1
+        ''', (question_embedding, sorted(doc_ids), model, ANSWER_CACHE_MAX_AGE_DAYS))
+        row = cur.fetchone()
+
+        hit = row is not None and 1 - row[2] >= ANSWER_CACHE_THRESHOLD
+        if hit:
+            cur.execute("UPDATE answer_cache SET hit_count = hit_count + 1, last_hit_at = NOW() WHERE id = %s",
+                        (row[0],))
+        fields['hit'] = hit
+
+    with _stats_lock:
+        _lookups += 1
+        _hits += hit
+    return row[1] if hit else None
+
+
+def store(question, question_embedding, doc_ids, model, answer):
+    if not ANSWER_CACHE_ENABLED:
+        return
+    ensure_table()
+    with span('db.answer_cache_store'), db.cursor() as cur:
+        cur.execute('''
+            INSERT INTO answer_cache (question, question_embedding, doc_ids, model, answer)
+            VALUES (%s, %s::vector, %s::integer[], %s, %s)
+        ''', (question, question_embedding, sorted(doc_ids), model, answer))
+
+
+def stats():
+    """Hit rate for this process plus totals persisted across restarts"""
+    with _stats_lock:
+        session = {'hits': _hits, 'lookups': _lookups, 'hit_rate': _hits / _lookups if _lookups else 0.0}
+    if not ANSWER_CACHE_ENABLED:
+        return dict(session, stored=0, total_hits=0)
+    ensure_table()
+    with db.cursor() as cur:
+        cur.execute("SELECT COUNT(*), COALESCE(SUM(hit_count), 0) FROM answer_cache")
+        stored, total_hits = cur.fetchone()
+    return dict(session, stored=stored, total_hits=int(total_hits))
+
+
+def format_stats(cache_stats=None):
+    cache_stats = stats() if cache_stats is None else cache_stats
+    if not ANSWER_CACHE_ENABLED:
+        return "Answer cache: disabled"
+    return (f"Answer cache: {cache_stats['hits']}/{cache_stats['lookups']} hits this session "
+            f"({cache_stats['hit_rate']:.0%}), {cache_stats['total_hits']} hits over "
+            f"{cache_stats['stored']} stored answers")
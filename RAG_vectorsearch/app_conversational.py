@@ -1,14 +1,18 @@
 # Web interface for conversational search
 import streamlit as st
-import psycopg2
-from pgvector.psycopg2 import register_vector
-from sentence_transformers import SentenceTransformer
-from anthropic import Anthropic
-import os
 from dotenv import load_dotenv
-import httpx
+import db
+import answer_cache
+from aggregates import answer_aggregate, detect_intent
+from llm import create_client, stream_claude
+import result_cache
+from embeddings import describe_model, encode_query, format_cache_stats, get_model
+from rerank import get_reranker
+from retrieval import parse_filters, search_docs, semantic_search_page
+from timing import configure_logging, trace
 
 load_dotenv()
+configure_logging()
 
 # Page config
 st.set_page_config(
@@ -17,175 +21,53 @@ st.set_page_config(
     layout="wide"
 )
 
-# Load models (cached)
-@st.cache_resource
-def load_models():
-    sentence_model = SentenceTransformer('all-MiniLM-L6-v2')
-    # Fix proxy issue by providing custom httpx client
-    try:
-        claude_client = Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY'))
-    except TypeError:
-        claude_client = Anthropic(
-            api_key=os.getenv('ANTHROPIC_API_KEY'),
-            http_client=httpx.Client()
-        )
-    return sentence_model, claude_client
-
-sentence_model, claude_client = load_models()
-
-# Search function
-# Search function with hybrid search (semantic + keyword)
-def search_docs(query, limit=6):
-    conn = psycopg2.connect(
-        host=os.getenv('DB_HOST'),
-        database=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        port=os.getenv('DB_PORT')
-    )
-    register_vector(conn)
-    cur = conn.cursor()
-    
-    # Extract keywords - preserve technical terms
-    keywords = query.lower().split()
-    stop_words = {'any', 'the', 'and', 'or', 'have', 'we', 'seen', 'about', 'with', 'for', 'from', 'recently', 'latest', 'show', 'me', 'get', 'find', 'how', 'many', 'what', 'when', 'where', 'why', 'is', 'are', 'be', 'been', 'do', 'does', 'dont', 'can', 'could', 'should', 'would', 'may', 'might', 'must', 'will', 'shall', 'in', 'on', 'at', 'to', 'by', 'as', 'of', 'if', 'that', 'this', 'it', 'it\'s', 'you', 'we', 'they', 'them', 'their', 'your', 'our'}
-    keywords = [k.strip('?,;:.!') for k in keywords if k.strip('?,;:.!') not in stop_words and len(k) > 2]
-    
-    # DEBUG
-    print(f"DEBUG: Query: {query}")
-    print(f"DEBUG: Keywords extracted: {keywords}")
-    
-    results_dict = {}
-    
-    # Semantic search
-    query_embedding = sentence_model.encode(query).tolist()
-    
-    cur.execute('''
-        SELECT title, content, url, source,
-               1 - (embedding <=> %s::vector) as similarity
-        FROM sql_docs
-        ORDER BY embedding <=> %s::vector
-        LIMIT 10
-    ''', (query_embedding, query_embedding))
-    
-    semantic_results = cur.fetchall()
-    
-    print(f"DEBUG: Semantic results count: {len(semantic_results)}")
-    for title, _, _, source, sim in semantic_results[:3]:
-        print(f"  - {source}: {title[:50]}... (sim: {sim:.2f})")
-    
-    for title, content, url, source, similarity in semantic_results:
-        results_dict[url] = {
-            'title': title,
-            'content': content,
-            'url': url,
-            'source': source,
-            'similarity': float(similarity),
-            'method': 'semantic'
-        }
-    
-    # Keyword search - prioritize documents that match keywords
-    if keywords:
-        keyword_conditions = []
-        for keyword in keywords[:3]:
-            keyword_conditions.append(f"(title ILIKE '%{keyword}%' OR content ILIKE '%{keyword}%')")
-        
-        if keyword_conditions:
-            keyword_query = f"""
-                SELECT title, content, url, source,
-                       1.0 as similarity
-                FROM sql_docs
-                WHERE {' OR '.join(keyword_conditions)}
-                LIMIT 15
-            """
-            
-            print(f"DEBUG: Keyword query: {keyword_query}")
-            
-            cur.execute(keyword_query)
-            keyword_results = cur.fetchall()
-            
-            print(f"DEBUG: Keyword results count: {len(keyword_results)}")
-            for title, _, _, source, _ in keyword_results[:3]:
-                print(f"  - {source}: {title[:50]}...")
-            
-            # Prioritize keyword matches over pure semantic
-            for title, content, url, source, _ in keyword_results:
-                if url in results_dict:
-                    results_dict[url]['similarity'] = 1.0  # Boost to 1.0 if keyword matched
-                    results_dict[url]['method'] = 'keyword-match'
-                else:
-                    results_dict[url] = {
-                        'title': title,
-                        'content': content,
-                        'url': url,
-                        'source': source,
-                        'similarity': 1.0,  # Keyword matches get highest priority
-                        'method': 'keyword'
-                    }
-    
-    cur.close()
-    conn.close()
-    
-    sorted_results = sorted(results_dict.values(), key=lambda x: x['similarity'], reverse=True)
-    
-    # Diversify by source - get at least one from each source type
-    final_results = []
-    urls_used = set()
-    sources_used = set()
-    
-    # First pass: take best match from each source type
-    for r in sorted_results:
-        if r['source'] not in sources_used:
-            final_results.append(r)
-            urls_used.add(r['url'])
-            sources_used.add(r['source'])
-    
-    # Fill remaining slots with best overall matches
-    for r in sorted_results:
-        if len(final_results) >= limit:
-            break
-        if r['url'] not in urls_used:
-            final_results.append(r)
-            urls_used.add(r['url'])
-    
-    print(f"DEBUG: Final results count: {len(final_results)}")
-    for r in final_results:
-        print(f"  - {r['source']}: {r['title'][:50]}... ({r['similarity']:.2f}, {r['method']})")
-    
-    return [(r['title'], r['content'], r['url'], r['source'], r['similarity']) for r in final_results]
-
-
-# Ask Claude
-def ask_claude(question, results):
-    # Map source to label
-    source_labels = {
-        'blog': '📚 Blog Post',
-        'documentation': '📗 Runbook',
-        'microsoft': '📘 Microsoft Docs',
-        'servicenow': '🎫 ServiceNow Incident'
-    }
-    
-    context = "\n\n---\n\n".join([
-        f"{source_labels.get(source, source)}: {title}\n\nContent: {content}\n\nURL: {url}"
-        for title, content, url, source, _ in results
-    ])
-    
-    prompt = f"""You are a helpful SQL Server expert. Answer the user's question based on these resources.
-
-RESOURCES:
-{context}
+# Load models (cached) on the first question rather than on page load
+@st.cache_resource(show_spinner="Loading models...")
+def load_sentence_model():
+    if get_reranker() is not None:
+        get_reranker().load()  # load the cross-encoder with the embedding model, not inside a search
+    return get_model()
 
-QUESTION: {question}
-
-Keep your answer to 2-3 sentences max. Be concise and direct. End with "Elaborate?" if more detail would help."""
+@st.cache_resource
+def load_claude_client():
+    return create_client()
 
-    message = claude_client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=300,
-        messages=[{"role": "user", "content": prompt}]
-    )
-    
-    return message.content[0].text
+# Search result cache, invalidated by loader NOTIFY events (one listener per process)
+@st.cache_resource
+def load_search_cache():
+    return result_cache.start_listener()
+
+search_cache = load_search_cache()
+
+MORE_PAGE_SIZE = 6
+
+SOURCE_LABELS = {
+    'blog': '📚 Blog Post',
+    'microsoft': '📘 Microsoft Docs',
+    'servicenow': '🎫 ServiceNow Incident'
+}
+
+def load_more(index):
+    """'Show more': the next keyset page of nearest documents, excluding those already listed"""
+    resources = st.session_state.messages[index]["resources"]
+    query_embedding = encode_query(load_sentence_model(), resources["query"])
+    with db.cursor() as cur:
+        # The answer's own results are mostly the first vector page: exclude them in SQL so this page is all new
+        page = semantic_search_page(cur, query_embedding, MORE_PAGE_SIZE, resources["filters"], resources["cursor"],
+                                    exclude_ids=[r.id for r in resources["results"]])
+    resources["results"] += page.results
+    resources["cursor"] = page.cursor
+    resources["exhausted"] = page.cursor is None
+    resources["expanded"] = True
+
+def show_resources(index, resources):
+    """Results expander of one answer (message `index` in the history), with a 'Show more' button"""
+    with st.expander("📚 Found relevant resources", expanded=resources["expanded"]):
+        for r in resources["results"]:
+            label = SOURCE_LABELS.get(r.source, r.source)
+            st.markdown(f"- **{label}**: {r.title} (relevance: {r.similarity:.1%}) - [Read]({r.url})")
+        if not resources["exhausted"]:
+            st.button("Show more", key=f"more_{index}", on_click=load_more, args=(index,))
 
 # UI
 st.title("⭐ Incident & Knowledge Search")
@@ -202,9 +84,11 @@ if "example_clicked" not in st.session_state:
     st.session_state.example_clicked = None
 
 # Display chat history
-for message in st.session_state.messages:
+for index, message in enumerate(st.session_state.messages):
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
+        if "resources" in message:
+            show_resources(index, message["resources"])
 
 # Handle example button clicks
 if st.session_state.example_clicked:
@@ -227,40 +111,64 @@ if prompt:
     
     # Generate response
     with st.chat_message("assistant"):
-        with st.spinner("Searching resources and thinking..."):
-            # Search
-            results = search_docs(prompt)
+        # Time every stage of this request (embedding, queries, MMR, Claude); logged as one JSON line
+        with trace('question', question=prompt) as request_trace:
+            # Inline filters like "source:servicenow after:2024-10-01" narrow the results
+            query, filters = parse_filters(prompt)
+            intent = detect_intent(query or prompt, filters)
+            results = []
+            resources = None
             
-            # Show which resources were found
-            with st.expander("📚 Found relevant resources"):
-                source_labels = {
-                    'blog': '📚 Blog Post',
-                    'microsoft': '📘 Microsoft Docs',
-                    'servicenow': '🎫 ServiceNow Incident'
-                }
+            if intent is not None:
+                # Counting / listing questions are answered from SQL aggregates, without search or Claude
+                answer = answer_aggregate(intent)
+                st.markdown(answer)
+                st.caption("⚡ Counted in the database (no LLM call)")
+            else:
+                with st.spinner("Searching resources..."):
+                    results = search_docs(query or prompt, filters=filters, model=load_sentence_model(),
+                                          cache=search_cache)
                 
-                for title, _, url, source, similarity in results:
-                    label = source_labels.get(source, source)
-                    st.markdown(f"- **{label}**: {title} (relevance: {similarity:.1%}) - [Read]({url})")
-            
-            # Get answer from Claude
-            answer = ask_claude(prompt, results)
-            st.markdown(answer)
-            
-            # Show sources with URLs
+                    # Show which resources were found ("Show more" pages on from here, keyset by distance)
+                    resources = {"query": query or prompt, "filters": filters, "results": list(results),
+                                 "cursor": None, "exhausted": False, "expanded": False}
+                    show_resources(len(st.session_state.messages), resources)
+                
+                # Stream the answer from Claude into the chat as tokens arrive
+                question_embedding = encode_query(load_sentence_model(), prompt)
+                usage = {}
+                answer = st.write_stream(stream_claude(load_claude_client(), prompt, results, question_embedding,
+                                                       sentence_model=load_sentence_model(), report=usage))
+                if usage.get('cached'):
+                    st.caption("⚡ Answer from cache")
+                elif 'input_tokens' in usage:
+                    st.caption(f"🧮 Prompt: {usage['input_tokens']} tokens "
+                               f"(packed to ~{usage['prompt_tokens_estimated']}), answer: {usage['output_tokens']} tokens")
+        
+        with st.expander("⏱️ Timings"):
+            for timed in request_trace.spans:
+                details = ', '.join(f"{key}={value}" for key, value in timed.items() if key not in ('name', 'ms'))
+                st.markdown(f"- `{timed['name']}` {timed['ms']:.1f} ms" + (f" ({details})" if details else ""))
+            st.markdown(f"**Total: {request_trace.total_ms:.0f} ms**")
+        
+        # Show sources with URLs
+        if results:
             st.markdown("---")
             st.markdown("**📖 Sources:**")
-            for title, _, url, source, _ in results:
-                source_labels = {
-                    'blog': '📚',
-                    'microsoft': '📘',
-                    'servicenow': '🎫'
-                }
-                icon = source_labels.get(source, '📄')
-                st.markdown(f"{icon} [{title}]({url})")
+        for r in results:
+            source_labels = {
+                'blog': '📚',
+                'microsoft': '📘',
+                'servicenow': '🎫'
+            }
+            icon = source_labels.get(r.source, '📄')
+            st.markdown(f"{icon} [{r.title}]({r.url})")
     
     # Add assistant response to chat history
-    st.session_state.messages.append({"role": "assistant", "content": answer})
+    reply = {"role": "assistant", "content": answer}
+    if resources is not None:
+        reply["resources"] = resources
+    st.session_state.messages.append(reply)
 
 # Sidebar
 with st.sidebar:
@@ -308,4 +216,9 @@ with st.sidebar:
         st.rerun()
     
     st.divider()
+    st.caption(db.format_pool_stats())
+    st.caption(describe_model())
+    st.caption(format_cache_stats())
+    st.caption(result_cache.format_cache_stats())
+    st.caption(answer_cache.format_stats())
     st.caption("Powered by Claude Sonnet 4 + pgvector")
\ No newline at end of file
@@ -0,0 +1,609 @@
+# Retrieval benchmarks
+#
+#   python benchmark.py filtered --rows 100000 --queries 50
+#   python benchmark.py rerank
+#   python benchmark.py prepared --rows 20000 --qps 20
+#   python benchmark.py wire --ingest-rows 20000
+#   python benchmark.py embedding --backends torch onnx onnx-int8
+#   python benchmark.py startup
+#   python benchmark.py embedding-server --concurrency 16   (with embedding_server.py running)
+#   python benchmark.py search-many --queries 500 --chunk 50
+#
+# Synthetic data lives in its own schema (rag_bench) so the real corpus is never touched.
+# Quality benchmarks run against the loaded corpus (run the loaders first).
+import argparse
+import json
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import psycopg2
+from pgvector.psycopg2 import register_vector
+from dotenv import load_dotenv
+import db
+from evaluate import LABELED_QUERIES, percentile, ranking_metrics
+from embeddings import EMBEDDING_BACKENDS, EMBEDDING_SERVER_URL, EmbeddingClient, load_model
+from retrieval import SearchFilters, semantic_search, semantic_search_many, extract_keywords, hybrid_search
+
+load_dotenv()
+
+BENCH_SCHEMA = 'rag_bench'
+BENCH_TABLE = f'{BENCH_SCHEMA}.sql_docs'
+DIMENSIONS = 384
+
+# Skewed source mix so filters cover a wide range of selectivities
+SOURCE_WEIGHTS = {
+    'blog': 0.60,
+    'microsoft': 0.25,
+    'documentation': 0.10,
+    'servicenow': 0.04,
+    'rca': 0.01,
+}
+
+
+def connect():
+    # A dedicated connection, not a pooled one: the benchmark changes search_path for the session
+    conn = psycopg2.connect(**db.connection_params())
+    register_vector(conn)
+    return conn
+
+
+def use_bench_schema(cur):
+    # Unqualified "sql_docs" in the retrieval queries now resolves to the synthetic table; refuse
+    # when it does not exist, or the name would fall through to public.sql_docs (the real corpus)
+    cur.execute("SELECT to_regclass(%s)", (BENCH_TABLE,))
+    if cur.fetchone()[0] is None:
+        raise RuntimeError(f"{BENCH_TABLE} does not exist; build the synthetic corpus first")
+    cur.execute(f"SET search_path = {BENCH_SCHEMA}, public")
+
+
+def random_documents(rows, seed=42):
+    """(title, content, url, embedding, created_at, source) rows with random float32 embeddings"""
+    rng = random.Random(seed)
+    vectors = np.random.default_rng(seed).standard_normal((rows, DIMENSIONS), dtype=np.float32)
+    sources = list(SOURCE_WEIGHTS)
+    weights = list(SOURCE_WEIGHTS.values())
+    start = datetime(2022, 1, 1)
+    for i in range(rows):
+        source = rng.choices(sources, weights)[0]
+        created_at = start + timedelta(minutes=rng.randrange(3 * 365 * 24 * 60))
+        yield f"doc {i}", f"synthetic document {i}", f"https://bench/{i}", vectors[i], created_at, source
+
+
+DOC_COLUMNS = ('title', 'content', 'url', 'embedding', 'created_at', 'source')
+
+
+def build_synthetic_corpus(conn, rows, seed=42):
+    """Create rag_bench.sql_docs with `rows` random documents and an HNSW index"""
+    cur = conn.cursor()
+    cur.execute(f"CREATE SCHEMA IF NOT EXISTS {BENCH_SCHEMA}")
+
+    # Every name here is schema-qualified: an unqualified sql_docs would be public.sql_docs, the real corpus
+    cur.execute("SELECT to_regclass(%s)", (BENCH_TABLE,))
+    if cur.fetchone()[0]:
+        cur.execute(f"SELECT COUNT(*) FROM {BENCH_TABLE}")
+        if cur.fetchone()[0] == rows:
+            print(f"Reusing {BENCH_SCHEMA}.sql_docs ({rows} rows)")
+            conn.commit()
+            return
+        cur.execute(f"DROP TABLE {BENCH_TABLE}")
+
+    print(f"Building {BENCH_SCHEMA}.sql_docs with {rows} rows...")
+    cur.execute(f'''
+        CREATE TABLE {BENCH_TABLE} (
+            id serial PRIMARY KEY,
+            title text NOT NULL,
+            content text NOT NULL,
+            url text,
+            embedding vector({DIMENSIONS}),
+            created_at timestamp without time zone,
+            source character varying(50)
+        )
+    ''')
+
+    batch = []
+    for i, document in enumerate(random_documents(rows, seed)):
+        batch.append(document)
+        if len(batch) == 5000 or i == rows - 1:
+            db.copy_rows(cur, BENCH_TABLE, DOC_COLUMNS, batch)
+            batch = []
+            print(f"  {i + 1}/{rows}")
+
+    print("Creating indexes...")
+    cur.execute(f"CREATE INDEX ON {BENCH_TABLE} USING hnsw (embedding vector_cosine_ops)")
+    cur.execute(f"CREATE INDEX ON {BENCH_TABLE} (source)")
+    cur.execute(f"CREATE INDEX ON {BENCH_TABLE} (created_at)")
+    cur.execute(f"ANALYZE {BENCH_TABLE}")
+    conn.commit()
+    print("✅ Synthetic corpus ready\n")
+
+
+def sample_queries(cur, count, seed=7):
+    """Use stored embeddings as query vectors so no model is needed"""
+    cur.execute("SELECT setseed(%s)", (seed / 100.0,))
+    cur.execute("SELECT embedding FROM sql_docs ORDER BY random() LIMIT %s", (count,))
+    return [row[0] for row in cur.fetchall()]
+
+
+def exact_search(cur, query_embedding, limit, filters):
+    """Ground truth: the same query with index scans disabled"""
+    cur.execute("SET LOCAL enable_indexscan = off")
+    return semantic_search(cur, query_embedding, limit, filters, strategy='plain')
+
+
+def filter_cases(cur):
+    """Filters spanning high to very low selectivity"""
+    cur.execute("SELECT COUNT(*) FROM sql_docs")
+    total = cur.fetchone()[0]
+
+    cases = [('none', None)]
+    cur.execute("SELECT source, COUNT(*) FROM sql_docs GROUP BY source ORDER BY COUNT(*) DESC")
+    for source, count in cur.fetchall():
+        cases.append((f"source={source} ({count / total:.1%})", SearchFilters(sources=[source])))
+
+    cur.execute("SELECT MAX(created_at) FROM sql_docs")
+    newest = cur.fetchone()[0]
+    for days in (365, 30, 7):
+        after = newest - timedelta(days=days)
+        cur.execute("SELECT COUNT(*) FROM sql_docs WHERE created_at >= %s", (after,))
+        count = cur.fetchone()[0]
+        cases.append((f"last {days}d ({count / total:.1%})", SearchFilters(created_after=after)))
+
+    after = newest - timedelta(days=90)
+    cur.execute("SELECT COUNT(*) FROM sql_docs WHERE source = 'servicenow' AND created_at >= %s", (after,))
+    count = cur.fetchone()[0]
+    cases.append((f"servicenow+90d ({count / total:.2%})",
+                  SearchFilters(sources=['servicenow'], created_after=after)))
+    return cases
+
+
+def bench_filtered(conn, args):
+    """Latency and recall of filtered top-k across selectivities for each scan strategy"""
+    cur = conn.cursor()
+    use_bench_schema(cur)
+    queries = sample_queries(cur, args.queries)
+    conn.commit()
+
+    strategies = ['plain', 'overfetch', 'iterative']
+    print(f"{'filter':<32}{'strategy':<12}{'p50 ms':>9}{'p95 ms':>9}{'rows':>7}{'recall':>8}")
+    print("-" * 77)
+
+    for label, filters in filter_cases(cur):
+        conn.commit()
+        truth = []
+        for query_embedding in queries:
+            truth.append({row[2] for row in exact_search(cur, query_embedding, args.k, filters)})
+            conn.commit()
+
+        for strategy in strategies:
+            latencies = []
+            returned = []
+            recalls = []
+            for query_embedding, expected in zip(queries, truth):
+                started = time.perf_counter()
+                rows = semantic_search(cur, query_embedding, args.k, filters, strategy=strategy)
+                latencies.append((time.perf_counter() - started) * 1000)
+                conn.commit()
+                returned.append(len(rows))
+                if expected:
+                    recalls.append(len(expected & {row[2] for row in rows}) / len(expected))
+
+            print(f"{label:<32}{strategy:<12}{percentile(latencies, 50):>9.2f}"
+                  f"{percentile(latencies, 95):>9.2f}{statistics.mean(returned):>7.1f}"
+                  f"{statistics.mean(recalls) if recalls else 0:>8.2f}")
+        print()
+
+    cur.close()
+
+
+def bench_rerank(conn, args):
+    """Latency added by the cross-encoder against the ranking quality it gains"""
+    from rerank import RERANK_SNIPPET_CHARS, Reranker
+
+    model = load_model()
+    reranker = Reranker(candidates=args.candidates, budget_ms=float('inf'))
+    reranker.load().predict([("warm up", "warm up")], show_progress_bar=False)
+
+    cur = conn.cursor()
+    baseline = []
+    reranked = []
+    latencies = []
+    for question, expected_url in LABELED_QUERIES:
+        candidates = hybrid_search(cur, model.encode(question), extract_keywords(question),
+                                   args.candidates, content_chars=RERANK_SNIPPET_CHARS)
+        conn.commit()
+        started = time.perf_counter()
+        ordered, _ = reranker.rerank(question, candidates)
+        latencies.append((time.perf_counter() - started) * 1000)
+        baseline.append(ranking_metrics([r.url for r in candidates], expected_url, args.k))
+        reranked.append(ranking_metrics([r.url for r in ordered], expected_url, args.k))
+    cur.close()
+
+    print(f"{len(LABELED_QUERIES)} labeled queries, {args.candidates} candidates, k={args.k}\n")
+    print(f"{'ranking':<12}{'recall@k':>10}{'MRR':>8}{'nDCG@k':>9}")
+    for label, metrics in (('fused', baseline), ('reranked', reranked)):
+        print(f"{label:<12}{statistics.mean(m['recall'] for m in metrics):>10.3f}"
+              f"{statistics.mean(m['mrr'] for m in metrics):>8.3f}"
+              f"{statistics.mean(m['ndcg'] for m in metrics):>9.3f}")
+    print(f"\nRerank latency added: p50 {percentile(latencies, 50):.1f} ms, "
+          f"p95 {percentile(latencies, 95):.1f} ms, max {max(latencies):.1f} ms")
+
+
+def planning_ms(cur, statement):
+    """Server-side planning time of an already interpolated statement (plain SQL or EXECUTE)"""
+    if statement.startswith(b"SET LOCAL "):
+        statement = statement.partition(b"; ")[2]  # db.execute_prepared's plan_cache_mode prefix
+    cur.execute(b"EXPLAIN (ANALYZE, FORMAT JSON) " + statement)
+    plan = cur.fetchone()[0]
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    return plan[0]['Planning Time']
+
+
+def plan_counts(cur):
+    """{statement name: (generic plans, custom plans)} of this session's prepared statements (PG 14+)"""
+    cur.execute("SELECT name, generic_plans, custom_plans FROM pg_prepared_statements WHERE name LIKE 'rag\\_%'")
+    return {name: (generic, custom) for name, generic, custom in cur.fetchall()}
+
+
+# (label, DB_PREPARED_STATEMENTS, DB_PLAN_CACHE_MODE) compared by bench_prepared
+PREPARED_MODES = [
+    ('plain', False, ''),
+    ('auto', True, ''),
+    ('generic', True, 'force_generic_plan'),
+]
+
+
+def bench_prepared(conn, args):
+    """Planning time and latency of the retrieval statements: planned per call, prepared with Postgres'
+    plan cache heuristic (auto), and prepared with force_generic_plan"""
+    cur = conn.cursor()
+    use_bench_schema(cur)
+    queries = sample_queries(cur, args.queries)
+    conn.commit()
+
+    statements = {
+        'semantic_search': lambda q: semantic_search(cur, q, args.k),
+        'hybrid_search': lambda q: hybrid_search(cur, q, ['synthetic', 'document'], args.k),
+    }
+
+    print(f"{len(queries)} queries, k={args.k}\n")
+    print(f"{'statement':<18}{'mode':<10}{'plan ms':>9}{'p50 ms':>9}{'p95 ms':>9}{'generic':>9}{'custom':>8}")
+    print("-" * 72)
+    totals = {label: 0.0 for label, _, _ in PREPARED_MODES}  # p50 of one semantic + one hybrid query
+    configured_mode = db.PLAN_CACHE_MODE
+    for statement, run in statements.items():
+        for label, prepared, plan_cache_mode in PREPARED_MODES:
+            db.PREPARED_STATEMENTS = prepared
+            db.PLAN_CACHE_MODE = plan_cache_mode
+            before = plan_counts(cur)
+            for q in queries[:10]:
+                run(q)  # warm up; in auto mode Postgres weighs a cached generic plan after 5 runs
+                conn.commit()
+
+            latencies = []
+            plans = []
+            for q in queries:
+                started = time.perf_counter()
+                run(q)
+                latencies.append((time.perf_counter() - started) * 1000)
+                plans.append(planning_ms(cur, cur.query))
+                conn.commit()
+
+            # Which plans EXECUTE actually used: custom plans mean every call was planned anyway
+            after = plan_counts(cur)
+            generic, custom = (sum(counts[i] - before.get(name, (0, 0))[i] for name, counts in after.items())
+                               for i in (0, 1))
+            totals[label] += percentile(latencies, 50)
+            print(f"{statement:<18}{label:<10}{statistics.median(plans):>9.3f}{percentile(latencies, 50):>9.2f}"
+                  f"{percentile(latencies, 95):>9.2f}{generic if prepared else '-':>9}{custom if prepared else '-':>8}")
+    db.PREPARED_STATEMENTS = True
+    db.PLAN_CACHE_MODE = configured_mode
+    cur.close()
+
+    print(f"\np50 per request (one semantic + one hybrid query): "
+          + ', '.join(f"{label} {total:.2f} ms" for label, total in totals.items()))
+    print(f"At {args.qps:g} requests/s, prepared (auto) saves {(totals['plain'] - totals['auto']) * args.qps:.1f} ms "
+          f"per second; force_generic_plan saves {(totals['plain'] - totals['generic']) * args.qps:.1f} ms. "
+          f"Set DB_PLAN_CACHE_MODE=force_generic_plan only when it beats auto here.")
+
+
+def bench_wire(conn, args):
+    """Client CPU and wall time per ingested row and per query for each vector wire format"""
+    cur = conn.cursor()
+    use_bench_schema(cur)
+    documents = list(random_documents(args.ingest_rows, seed=99))
+    cur.execute("CREATE TEMP TABLE wire_docs (LIKE sql_docs INCLUDING DEFAULTS)")
+    conn.commit()
+
+    insert_sql = f"INSERT INTO wire_docs ({', '.join(DOC_COLUMNS)}) VALUES (%s, %s, %s, %s::vector, %s, %s)"
+    loaders = {
+        'INSERT list': lambda batch: cur.executemany(insert_sql, [d[:3] + (d[3].tolist(),) + d[4:] for d in batch]),
+        'INSERT numpy': lambda batch: cur.executemany(insert_sql, batch),
+        'COPY BINARY': lambda batch: db.copy_rows(cur, 'wire_docs', DOC_COLUMNS, batch),
+    }
+
+    print(f"Ingest: {len(documents)} rows, batches of {args.batch}\n")
+    print(f"{'format':<16}{'CPU us/row':>12}{'wall us/row':>13}")
+    print("-" * 41)
+    for label, load in loaders.items():
+        cur.execute("TRUNCATE wire_docs")
+        conn.commit()
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        for offset in range(0, len(documents), args.batch):
+            load(documents[offset:offset + args.batch])
+        conn.commit()
+        cpu = time.process_time() - cpu_started
+        wall = time.perf_counter() - started
+        print(f"{label:<16}{cpu / len(documents) * 1e6:>12.1f}{wall / len(documents) * 1e6:>13.1f}")
+
+    queries = sample_queries(cur, args.queries)
+    conn.commit()
+    print(f"\nQuery: {len(queries)} semantic searches, k={args.k}\n")
+    print(f"{'format':<16}{'CPU us/query':>14}{'p50 ms':>9}{'p95 ms':>9}")
+    print("-" * 48)
+    for label, convert in (('list', lambda q: q.tolist()), ('numpy', lambda q: q)):
+        latencies = []
+        cpu_started = time.process_time()
+        for q in queries:
+            started = time.perf_counter()
+            semantic_search(cur, convert(q), args.k)
+            latencies.append((time.perf_counter() - started) * 1000)
+            conn.commit()
+        cpu = time.process_time() - cpu_started
+        print(f"{label:<16}{cpu / len(queries) * 1e6:>14.1f}"
+              f"{percentile(latencies, 50):>9.2f}{percentile(latencies, 95):>9.2f}")
+    cur.close()
+
+
+def bench_embedding(conn, args):
+    """Agreement with the torch embeddings, single-query latency and batch throughput per backend"""
+    texts = [question for question, _ in LABELED_QUERIES]
+    # Longer, document-like inputs for the throughput run
+    documents = [f"{question}. " * 8 for question in texts] * max(1, args.batch // len(texts))
+
+    reference = load_model('torch')
+    reference_embeddings = reference.encode(texts, normalize_embeddings=True)
+
+    print(f"{'backend':<12}{'min cos':>9}{'mean cos':>10}{'top-1':>7}{'p50 ms':>9}{'p95 ms':>9}{'docs/s':>9}")
+    print("-" * 65)
+    for backend in args.backends:
+        model = reference if backend == 'torch' else load_model(backend)
+        embeddings = model.encode(texts, normalize_embeddings=True)
+
+        # Cosine agreement per text, and whether each query's nearest other query stays the same
+        agreement = np.sum(embeddings * reference_embeddings, axis=1)
+        reference_similarity = reference_embeddings @ reference_embeddings.T
+        similarity = embeddings @ embeddings.T
+        np.fill_diagonal(reference_similarity, -1)
+        np.fill_diagonal(similarity, -1)
+        top1 = np.mean(reference_similarity.argmax(axis=1) == similarity.argmax(axis=1))
+
+        model.encode(texts[:4])  # warm up
+        latencies = []
+        for _ in range(args.repeat):
+            for text in texts:
+                started = time.perf_counter()
+                model.encode(text)
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        model.encode(documents, batch_size=args.batch)
+        throughput = len(documents) / (time.perf_counter() - started)
+
+        print(f"{backend:<12}{agreement.min():>9.4f}{agreement.mean():>10.4f}{top1:>7.0%}"
+              f"{percentile(latencies, 50):>9.2f}{percentile(latencies, 95):>9.2f}{throughput:>9.1f}")
+        if agreement.min() < args.min_cosine:
+            print(f"  ⚠️  {backend} disagrees with torch (cosine {agreement.min():.4f} < {args.min_cosine}); "
+                  f"re-embed the corpus before switching EMBEDDING_BACKEND")
+
+
+def bench_search_many(conn, args):
+    """One statement per query vs LATERAL batches over a VALUES list of query vectors"""
+    cur = conn.cursor()
+    use_bench_schema(cur)
+    queries = sample_queries(cur, args.queries)
+    conn.commit()
+
+    started = time.perf_counter()
+    sequential = []
+    for q in queries:
+        sequential.append({r.id for r in semantic_search(cur, q, args.k)})
+        conn.commit()
+    sequential_seconds = time.perf_counter() - started
+
+    print(f"{len(queries)} queries, k={args.k}\n")
+    print(f"{'mode':<22}{'seconds':>9}{'queries/s':>11}{'overlap':>9}")
+    print("-" * 51)
+    print(f"{'one per query':<22}{sequential_seconds:>9.2f}{len(queries) / sequential_seconds:>11.1f}{'':>9}")
+
+    for chunk_size in args.chunk:
+        started = time.perf_counter()
+        batched = []
+        for start in range(0, len(queries), chunk_size):
+            batched.extend({r.id for r in results}
+                           for results in semantic_search_many(cur, queries[start:start + chunk_size], args.k))
+        conn.commit()
+        seconds = time.perf_counter() - started
+        # Same index, same k: the batches should find the same documents
+        overlap = statistics.mean(len(a & b) / len(a) if a else 1.0 for a, b in zip(sequential, batched))
+        print(f"{f'batches of {chunk_size}':<22}{seconds:>9.2f}{len(queries) / seconds:>11.1f}{overlap:>9.2f}")
+    cur.close()
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kilobytes on Linux
+
+
+def bench_embedding_server(conn, args):
+    """Concurrent single-query encode throughput and client memory: embedding server vs in-process model"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    client = EmbeddingClient(args.url)
+    if not client.available():
+        print(f"No embedding server at {args.url}; start one with: python embedding_server.py")
+        return
+    texts = [question for question, _ in LABELED_QUERIES]
+
+    def run(label, model):
+        def encode_one(i):
+            started = time.perf_counter()
+            model.encode(texts[i % len(texts)])
+            return (time.perf_counter() - started) * 1000
+
+        model.encode(texts[:2])  # warm up
+        with ThreadPoolExecutor(args.concurrency) as workers:
+            started = time.perf_counter()
+            latencies = list(workers.map(encode_one, range(args.requests)))
+            elapsed = time.perf_counter() - started
+        print(f"{label:<12}{args.requests / elapsed:>10.1f}{percentile(latencies, 50):>9.2f}"
+              f"{percentile(latencies, 95):>9.2f}{peak_rss_mb():>12.0f}")
+
+    print(f"{args.requests} single-query encodes from {args.concurrency} threads\n")
+    print(f"{'model':<12}{'req/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'client MB':>12}")
+    print("-" * 52)
+    run('server', client)
+    if client.fallback_calls:
+        print(f"  ⚠️  {client.fallback_calls} calls fell back to the in-process model")
+    run('in-process', load_model())
+
+    health = client.health() or {}
+    print(f"\nServer batching: {health.get('avg_batch_texts', 0):.1f} texts per batch over "
+          f"{health.get('batches', 0)} batches")
+    print("client MB is this process's peak RSS: the in-process row includes a private copy of the model, "
+          "which every process pays without the server")
+
+
+# Command-line entry points (the Streamlit app only runs under `streamlit run`)
+ENTRY_MODULES = ['agent_app', 'load_runbooks', 'load_servicenow_mock', 'load_microsoft_docs', 'llm',
+                 'embedding_server', 'benchmark']
+# Dependencies that should only be imported once there is work for them
+HEAVY_MODULES = ['torch', 'sentence_transformers', 'transformers', 'langchain', 'langchain_core',
+                 'langchain_community', 'anthropic']
+
+
+def parse_import_times(stderr):
+    """{module: (cumulative microseconds, nesting depth)} for every import in `python -X importtime` output
+
+    Depth 0 is imported by the statement itself; each level of nesting indents the name by two more spaces.
+    """
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times[name.strip()] = (int(cumulative), depth)
+    return times
+
+
+def import_times(module):
+    """Every module imported by `import module`, see parse_import_times"""
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                               capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    return parse_import_times(completed.stderr)
+
+
+def eager_heavy_modules(times):
+    """HEAVY_MODULES imported at any depth"""
+    return [name for name in HEAVY_MODULES if name in times]
+
+
+def bench_startup(conn, args):
+    """Import cost of each entry point, and whether heavy dependencies are deferred until used"""
+    print(f"{'module':<24}{'import ms':>10}  slowest imports (indented by depth) / heavy dependencies loaded")
+    print("-" * 90)
+    for module in args.modules:
+        try:
+            times = import_times(module)
+        except RuntimeError as e:
+            print(f"{module:<24}{'failed':>10}  {e}")
+            continue
+        total_ms = sum(us for us, depth in times.values() if depth == 0) / 1000
+        slowest = sorted(times.items(), key=lambda item: item[1][0], reverse=True)[:args.top]
+        heavy = eager_heavy_modules(times)
+        print(f"{module:<24}{total_ms:>10.0f}  "
+              + ', '.join(f"{'·' * depth}{name} {us / 1000:.0f}" for name, (us, depth) in slowest))
+        if heavy:
+            print(f"{'':<36}⚠️  imported eagerly: {', '.join(heavy)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval benchmarks")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    filtered = subparsers.add_parser('filtered', help="filtered vector search across selectivities")
+    filtered.add_argument('--rows', type=int, default=100000)
+    filtered.add_argument('--queries', type=int, default=50)
+    filtered.add_argument('-k', type=int, default=10)
+    filtered.set_defaults(run=bench_filtered, synthetic=True)
+
+    rerank = subparsers.add_parser('rerank', help="cross-encoder rerank latency vs ranking quality")
+    rerank.add_argument('--candidates', type=int, default=20)
+    rerank.add_argument('-k', type=int, default=6)
+    rerank.set_defaults(run=bench_rerank, synthetic=False)
+
+    prepared = subparsers.add_parser('prepared', help="planning time saved by prepared statements")
+    prepared.add_argument('--rows', type=int, default=20000)
+    prepared.add_argument('--queries', type=int, default=200)
+    prepared.add_argument('--qps', type=float, default=20.0, help="request rate to project the savings to")
+    prepared.add_argument('-k', type=int, default=10)
+    prepared.set_defaults(run=bench_prepared, synthetic=True)
+
+    wire = subparsers.add_parser('wire', help="vector wire formats: CPU per ingested row and per query")
+    wire.add_argument('--rows', type=int, default=20000)
+    wire.add_argument('--ingest-rows', type=int, default=20000)
+    wire.add_argument('--batch', type=int, default=1000)
+    wire.add_argument('--queries', type=int, default=200)
+    wire.add_argument('-k', type=int, default=10)
+    wire.set_defaults(run=bench_wire, synthetic=True)
+
+    embedding = subparsers.add_parser('embedding', help="embedding backends: agreement, latency, throughput")
+    embedding.add_argument('--backends', nargs='+', choices=EMBEDDING_BACKENDS, default=list(EMBEDDING_BACKENDS))
+    embedding.add_argument('--repeat', type=int, default=5)
+    embedding.add_argument('--batch', type=int, default=64)
+    embedding.add_argument('--min-cosine', type=float, default=0.99)
+    embedding.set_defaults(run=bench_embedding, synthetic=False, database=False)
+
+    startup = subparsers.add_parser('startup', help="import-time report for the entry points")
+    startup.add_argument('--modules', nargs='+', default=ENTRY_MODULES)
+    startup.add_argument('--top', type=int, default=4)
+    startup.set_defaults(run=bench_startup, synthetic=False, database=False)
+
+    embedding_server = subparsers.add_parser('embedding-server',
+                                             help="embedding server vs in-process model under concurrency")
+    embedding_server.add_argument('--url', default=EMBEDDING_SERVER_URL or 'http://127.0.0.1:8766')
+    embedding_server.add_argument('--concurrency', type=int, default=16)
+    embedding_server.add_argument('--requests', type=int, default=800)
+    embedding_server.set_defaults(run=bench_embedding_server, synthetic=False, database=False)
+
+    many = subparsers.add_parser('search-many', help="batched LATERAL search vs one statement per query")
+    many.add_argument('--rows', type=int, default=100000)
+    many.add_argument('--queries', type=int, default=500)
+    many.add_argument('--chunk', type=int, nargs='+', default=[10, 50, 200])
+    many.add_argument('-k', type=int, default=10)
+    many.set_defaults(run=bench_search_many, synthetic=True)
+
+    args = parser.parse_args()
+
+    if not getattr(args, 'database', True):
+        args.run(None, args)
+        return
+
+    conn = connect()
+    try:
+        if args.synthetic:
+            build_synthetic_corpus(conn, args.rows)
+        args.run(conn, args)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
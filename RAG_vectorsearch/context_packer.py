@@ -0,0 +1,84 @@
+# Token-budgeted context packing for the Claude prompt
+#
+# Instead of sending every result's full content, split each document into passages,
+# score all passages against the question in one batched encode + one matrix product,
+# and keep the best ones until the token budget is spent.
+import math
+import re
+import numpy as np
+import os
+from dotenv import load_dotenv
+from timing import span
+
+load_dotenv()
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '1500'))
+MAX_PASSAGES_PER_DOC = int(os.getenv('CONTEXT_MAX_PASSAGES_PER_DOC', '80'))
+MIN_PASSAGE_CHARS = 20
+MAX_PASSAGE_CHARS = 400
+
+_SENTENCE_BREAK = re.compile(r'(?<=[.!?])\s+|\n+')
+
+
+def estimate_tokens(text):
+    """Rough Claude token count (~4 characters per token)"""
+    return math.ceil(len(text) / 4)
+
+
+def split_passages(content):
+    """Sentences / lines of a document, long ones cut to MAX_PASSAGE_CHARS"""
+    passages = []
+    for piece in _SENTENCE_BREAK.split(content or ''):
+        piece = piece.strip()
+        if len(piece) < MIN_PASSAGE_CHARS:
+            continue
+        for start in range(0, len(piece), MAX_PASSAGE_CHARS):
+            passages.append(piece[start:start + MAX_PASSAGE_CHARS])
+        if len(passages) >= MAX_PASSAGES_PER_DOC:
+            break
+    return passages[:MAX_PASSAGES_PER_DOC]
+
+
+def pack_context(model, query_embedding, results, budget=CONTEXT_TOKEN_BUDGET):
+    """Results with content replaced by their most query-relevant passages, within `budget` tokens
+
+    Every result first gets its single best passage, then the remaining budget goes to
+    the best passages overall. Selected passages keep their original document order.
+    """
+    passages = []
+    owners = []
+    for index, r in enumerate(results):
+        for passage in split_passages(r.content):
+            passages.append(passage)
+            owners.append(index)
+
+    if not passages or budget <= 0:
+        return results
+
+    with span('pack_context.encode', passages=len(passages)):
+        passage_embeddings = model.encode(passages, batch_size=64, normalize_embeddings=True,
+                                          convert_to_numpy=True)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+    scores = passage_embeddings @ query
+    owners = np.asarray(owners)
+    costs = np.array([estimate_tokens(p) for p in passages])
+
+    order = np.argsort(-scores, kind='stable')
+    best_per_result = [order[owners[order] == index][:1] for index in range(len(results))]
+    priority = np.concatenate(best_per_result + [order])
+
+    selected = set()
+    spent = 0
+    for passage_index in priority:
+        passage_index = int(passage_index)
+        if passage_index in selected or spent + costs[passage_index] > budget:
+            continue
+        selected.add(passage_index)
+        spent += costs[passage_index]
+
+    packed = []
+    for index, r in enumerate(results):
+        kept = [passages[i] for i in sorted(selected) if owners[i] == index]
+        packed.append(r._replace(content=' … '.join(kept)))
+    return packed
@@ -0,0 +1,269 @@
+# Shared database access: one connection pool per process
+import atexit
+import hashlib
+import io
+import re
+import struct
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+import psycopg2
+from psycopg2 import errors, pool
+from pgvector.psycopg2 import register_vector
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+POOL_MIN_CONN = int(os.getenv('DB_POOL_MIN', '1'))
+POOL_MAX_CONN = int(os.getenv('DB_POOL_MAX', '10'))
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))          # seconds to wait for a free connection
+CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', '5'))       # seconds for the TCP/auth handshake
+STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '30000'))
+PREPARED_STATEMENTS = os.getenv('DB_PREPARED_STATEMENTS', 'true').lower() == 'true'
+# plan_cache_mode for prepared statements; empty keeps Postgres' auto heuristic. force_generic_plan
+# skips planning, but a generic plan cannot see the LIMIT or the query vector and may join through a
+# sequential scan: only set it when `benchmark.py prepared` shows it beating auto on your data
+PLAN_CACHE_MODE = os.getenv('DB_PLAN_CACHE_MODE', '')
+
+# NOTIFY channel for ingests into sql_docs (payload = source), see result_cache.py
+DOCS_CHANGED_CHANNEL = 'sql_docs_changed'
+
+
+_PLACEHOLDER = re.compile(r'%[%s]')
+
+# Statement names prepared on each connection (forgotten with the connection)
+_prepared = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+
+
+class PoolTimeout(Exception):
+    """No connection became free within DB_POOL_TIMEOUT seconds"""
+
+
+class VectorConnectionPool(pool.ThreadedConnectionPool):
+    """Thread-safe pool that blocks for a free connection and registers the vector type once per connection"""
+
+    def __init__(self, minconn, maxconn, timeout, **kwargs):
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._timeout = timeout
+        self._stats_lock = threading.Lock()
+        self._waits = []
+        self._timeouts = 0
+        super().__init__(minconn, maxconn, **kwargs)
+
+    def _connect(self, key=None):
+        conn = super()._connect(key)
+        register_vector(conn)
+        conn.commit()  # register_vector runs a query; don't leave the new connection mid-transaction
+        return conn
+
+    def getconn(self, key=None):
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self._timeout):
+            with self._stats_lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"no database connection available after {self._timeout}s")
+        waited = time.perf_counter() - started
+
+        with self._stats_lock:
+            self._waits.append(waited)
+            del self._waits[:-1000]  # keep a rolling window
+
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        with self._stats_lock:
+            waits = sorted(self._waits)
+            timeouts = self._timeouts
+        in_use = len(self._used)
+        if not waits:
+            return {'acquired': 0, 'in_use': in_use, 'max_size': self.maxconn, 'timeouts': timeouts,
+                    'avg_wait_ms': 0.0, 'p95_wait_ms': 0.0, 'max_wait_ms': 0.0}
+        return {
+            'acquired': len(waits),
+            'in_use': in_use,
+            'max_size': self.maxconn,
+            'timeouts': timeouts,
+            'avg_wait_ms': sum(waits) / len(waits) * 1000,
+            'p95_wait_ms': waits[int(0.95 * (len(waits) - 1))] * 1000,
+            'max_wait_ms': waits[-1] * 1000,
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def connection_params(database=None):
+    return dict(
+        host=os.getenv('DB_HOST'),
+        database=database or os.getenv('DB_NAME'),
+        user=os.getenv('DB_USER'),
+        password=os.getenv('DB_PASSWORD'),
+        port=os.getenv('DB_PORT'),
+        connect_timeout=CONNECT_TIMEOUT,
+        options=f"-c statement_timeout={STATEMENT_TIMEOUT_MS}",
+    )
+
+
+def get_pool():
+    """Create the process-wide pool on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = VectorConnectionPool(POOL_MIN_CONN, POOL_MAX_CONN, POOL_TIMEOUT,
+                                             **connection_params())
+                atexit.register(_pool.closeall)
+    return _pool
+
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection; commits on success, rolls back on error"""
+    db_pool = get_pool()
+    conn = db_pool.getconn()
+    broken = False
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+        raise
+    finally:
+        db_pool.putconn(conn, close=broken or conn.closed != 0)
+
+
+@contextmanager
+def cursor():
+    """Borrow a pooled connection and yield a cursor on it"""
+    with connection() as conn:
+        cur = conn.cursor()
+        try:
+            yield cur
+        finally:
+            cur.close()
+
+
+def statement_name(sql):
+    return 'rag_' + hashlib.md5(sql.encode()).hexdigest()[:16]
+
+
+def numbered_placeholders(sql):
+    """psycopg2 %s placeholders -> $1, $2, ... for PREPARE (%% becomes a literal %)"""
+    counter = iter(range(1, sql.count('%s') + 1))
+    return _PLACEHOLDER.sub(lambda m: '%' if m.group() == '%%' else f"${next(counter)}", sql)
+
+
+def execute_prepared(cur, sql, params=()):
+    """Run `sql` as a server-side prepared statement on the cursor's connection
+
+    The first call on a connection PREPAREs the statement (parse + analyze once); later calls
+    only EXECUTE it, and Postgres decides per call whether to reuse a cached generic plan
+    (DB_PLAN_CACHE_MODE overrides that with SET LOCAL plan_cache_mode, in the same round trip).
+    Parameters are bound as in cur.execute; casts in the SQL (%s::vector) fix their types.
+    """
+    if not PREPARED_STATEMENTS:
+        cur.execute(sql, params)
+        return
+
+    name = statement_name(sql)
+    with _prepared_lock:
+        prepared = _prepared.setdefault(cur.connection, set())
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} AS {numbered_placeholders(sql)}")
+        prepared.add(name)
+
+    execute = f"EXECUTE {name} ({', '.join(['%s'] * len(params))})" if params else f"EXECUTE {name}"
+    if PLAN_CACHE_MODE:
+        execute = f"SET LOCAL plan_cache_mode = {PLAN_CACHE_MODE}; {execute}"
+    try:
+        cur.execute(execute, params or None)
+    except errors.InvalidSqlStatementName:
+        prepared.discard(name)  # deallocated behind our back (DISCARD ALL); prepare again next time
+        raise
+
+
+# COPY ... (FORMAT BINARY): signature, flags, header extension length
+_COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+_COPY_TRAILER = struct.pack('>h', -1)
+_POSTGRES_EPOCH = datetime(2000, 1, 1)
+
+
+def _binary_field(value):
+    """One field of a binary COPY row: int32 length + the type's binary send format"""
+    if value is None:
+        return struct.pack('>i', -1)
+    if isinstance(value, np.ndarray):
+        # pgvector: int16 dimensions, int16 unused, float4 values (big-endian)
+        data = struct.pack('>hh', len(value), 0) + value.astype('>f4', copy=False).tobytes()
+    elif isinstance(value, datetime):
+        # timestamp without time zone: int64 microseconds since 2000-01-01
+        delta = value - _POSTGRES_EPOCH
+        data = struct.pack('>q', (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+    else:
+        raise TypeError(f"no binary COPY encoding for {type(value).__name__}")
+    return struct.pack('>i', len(data)) + data
+
+
+def copy_rows(cur, table, columns, rows):
+    """Bulk insert with COPY ... FORMAT BINARY (text, varchar, vector and timestamp columns)
+
+    Embeddings go over the wire as packed float4 arrays: no Python lists, no float-to-text
+    formatting on the client and no vector text parsing on the server.
+    """
+    buffer = io.BytesIO()
+    buffer.write(_COPY_HEADER)
+    field_count = struct.pack('>h', len(columns))
+    for row in rows:
+        buffer.write(field_count)
+        for value in row:
+            buffer.write(_binary_field(value))
+    buffer.write(_COPY_TRAILER)
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT BINARY)", buffer)
+    return len(rows)
+
+
+def existing_urls(cur, urls):
+    """URLs already in sql_docs, so loaders skip them without a query per document"""
+    cur.execute("SELECT url FROM sql_docs WHERE url = ANY(%s::text[])", (list(urls),))
+    return {url for url, in cur.fetchall()}
+
+
+def notify_docs_changed(cur, source):
+    """Queue a NOTIFY for this transaction; listeners only receive it once the insert commits"""
+    cur.execute("SELECT pg_notify(%s, %s)", (DOCS_CHANGED_CHANNEL, source))
+
+
+def pool_stats():
+    """Pool size and wait times for this process (empty before the first query)"""
+    return get_pool().stats() if _pool is not None else {}
+
+
+def format_pool_stats(stats=None):
+    stats = pool_stats() if stats is None else stats
+    if not stats:
+        return "DB pool: not started"
+    return (f"DB pool: {stats['in_use']}/{stats['max_size']} in use, "
+            f"wait avg {stats['avg_wait_ms']:.1f} ms, p95 {stats['p95_wait_ms']:.1f} ms, "
+            f"max {stats['max_wait_ms']:.1f} ms, {stats['timeouts']} timeouts")
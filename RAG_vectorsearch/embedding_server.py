@@ -0,0 +1,200 @@
+# Local embedding service: one copy of the model per host, concurrent requests batched together
+#
+#   python embedding_server.py --port 8766 --max-batch 64 --max-wait-ms 5
+#
+# The web UI, the agent and the loaders use it through embeddings.get_model() when it is
+# reachable at EMBEDDING_SERVER_URL, and load the model in-process otherwise.
+#
+#   POST /embed   {"texts": [...], "normalize": false}  ->  float32 matrix (little-endian), X-Embedding-Dimensions header
+#   GET  /health  ->  model, backend, dimensions, normalization and batching statistics (JSON)
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Queue
+import numpy as np
+from embeddings import EMBEDDING_BACKEND, EMBEDDING_MODEL, load_model, model_normalizes
+
+
+class EmbeddingRequest:
+    def __init__(self, texts):
+        self.texts = texts
+        self.done = threading.Event()
+        self.embeddings = None
+        self.error = None
+
+
+class DynamicBatcher:
+    """Coalesces concurrent requests into one model.encode call
+
+    A batch starts with the oldest waiting request and takes more until it holds `max_batch`
+    texts or `max_wait_ms` has passed, so a lone request waits at most `max_wait_ms`.
+    """
+
+    def __init__(self, model, max_batch=64, max_wait_ms=5.0):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = Queue()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+        self.encode_seconds = 0.0
+        threading.Thread(target=self._run, name='embedding-batcher', daemon=True).start()
+
+    def encode(self, texts):
+        request = EmbeddingRequest(texts)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.embeddings
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        size = len(batch[0].texts)
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except Empty:
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for request in batch for text in request.texts]
+            started = time.perf_counter()
+            try:
+                embeddings = self.model.encode(texts, batch_size=max(len(texts), 1), convert_to_numpy=True)
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+                    request.done.set()
+                continue
+            elapsed = time.perf_counter() - started
+
+            offset = 0
+            for request in batch:
+                request.embeddings = embeddings[offset:offset + len(request.texts)]
+                offset += len(request.texts)
+                request.done.set()
+
+            with self._stats_lock:
+                self.batches += 1
+                self.requests += len(batch)
+                self.texts += len(texts)
+                self.encode_seconds += elapsed
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'batches': self.batches,
+                'requests': self.requests,
+                'texts': self.texts,
+                'avg_batch_texts': self.texts / self.batches if self.batches else 0.0,
+                'encode_seconds': round(self.encode_seconds, 3),
+            }
+
+
+class EmbeddingHandler(BaseHTTPRequestHandler):
+    batcher = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass  # keep the console quiet under load
+
+    def send_body(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, payload):
+        self.send_body(status, 'application/json', json.dumps(payload).encode())
+
+    def do_GET(self):
+        if self.path != '/health':
+            self.send_error(404)
+            return
+        model = self.batcher.model
+        self.send_json(200, {'model': EMBEDDING_MODEL, 'backend': EMBEDDING_BACKEND,
+                             'dimensions': model.get_sentence_embedding_dimension(),
+                             'normalized': model_normalizes(model),
+                             'max_batch': self.batcher.max_batch,
+                             'max_wait_ms': self.batcher.max_wait * 1000, **self.batcher.stats()})
+
+    def do_POST(self):
+        if self.path != '/embed':
+            self.send_error(404)
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            texts = body['texts']
+            normalize = body.get('normalize', False)
+            if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                raise ValueError("'texts' must be a list of strings")
+            if not isinstance(normalize, bool):
+                raise ValueError("'normalize' must be true or false")
+        except (ValueError, KeyError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        try:
+            embeddings = self.batcher.encode(texts) if texts else np.zeros((0, 0), dtype=np.float32)
+        except Exception as e:
+            self.send_json(500, {'error': str(e)})
+            return
+        if normalize and len(embeddings):
+            # Per request: the batch it was encoded in may mix normalized and raw requests
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.where(norms == 0, 1.0, norms)
+        embeddings = np.ascontiguousarray(embeddings, dtype='<f4')
+        self.send_body(200, 'application/octet-stream', embeddings.tobytes(),
+                       {'X-Embedding-Dimensions': str(embeddings.shape[1] if embeddings.ndim == 2 else 0)})
+
+
+def serve(host, port, batcher):
+    EmbeddingHandler.batcher = batcher
+    server = ThreadingHTTPServer((host, port), EmbeddingHandler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local embedding server with dynamic batching")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"Loading {EMBEDDING_MODEL} ({EMBEDDING_BACKEND})...")
+    model = load_model()
+    model.encode("warm up")
+    batcher = DynamicBatcher(model, args.max_batch, args.max_wait_ms)
+
+    server = serve(args.host, args.port, batcher)
+    print(f"Embedding server listening on http://{args.host}:{args.port} "
+          f"(batches up to {args.max_batch} texts, {args.max_wait_ms:g} ms window)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+# Embedding model loading (torch or ONNX backends, or the local embedding server)
+# and query embeddings with a process-wide LRU cache
+import http.client
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+import numpy as np
+import os
+from dotenv import load_dotenv
+from timing import logger, span
+
+load_dotenv()
+
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_EMBEDDING_CACHE_SIZE', '1024'))
+
+# Models whose tokenizer lowercases its input (do_lower_case), so queries differing only in case
+# embed identically and can share a cache entry; set EMBEDDING_UNCASED for other models
+UNCASED_MODELS = {'all-MiniLM-L6-v2', 'all-MiniLM-L12-v2', 'paraphrase-MiniLM-L6-v2', 'multi-qa-MiniLM-L6-cos-v1'}
+EMBEDDING_UNCASED = os.getenv('EMBEDDING_UNCASED',
+                              str(EMBEDDING_MODEL.split('/')[-1] in UNCASED_MODELS)).lower() == 'true'
+
+# Inference backend for the embedding model:
+#   torch     - PyTorch (default)
+#   onnx      - the model's ONNX export on ONNX Runtime
+#   onnx-int8 - a dynamically int8-quantized ONNX export (EMBEDDING_ONNX_INT8_FILE)
+# The ONNX backends need `pip install "optimum[onnxruntime]"`.
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch')
+EMBEDDING_ONNX_INT8_FILE = os.getenv('EMBEDDING_ONNX_INT8_FILE', 'onnx/model_quint8_avx2.onnx')
+EMBEDDING_BACKENDS = ('torch', 'onnx', 'onnx-int8')
+
+# What the stored vectors were made with: vector(384) columns (setup_db.py), and all-MiniLM-L6-v2
+# ends in a Normalize layer. The embedding server must produce the same, see EmbeddingClient.available()
+EMBEDDING_DIMENSIONS = int(os.getenv('EMBEDDING_DIMENSIONS', '384'))
+EMBEDDING_NORMALIZED = os.getenv('EMBEDDING_NORMALIZED', 'true').lower() == 'true'
+
+# embedding_server.py; empty to always load the model in-process
+EMBEDDING_SERVER_URL = os.getenv('EMBEDDING_SERVER_URL', 'http://127.0.0.1:8766')
+EMBEDDING_SERVER_TIMEOUT = float(os.getenv('EMBEDDING_SERVER_TIMEOUT', '10'))
+SERVER_RETRY_SECONDS = 30      # after a failed call, use the in-process model this long before retrying
+SERVER_MAX_TEXTS = 256         # texts per request; larger inputs are split
+
+
+def load_model(backend=None, model_name=None):
+    """SentenceTransformer for EMBEDDING_MODEL on the configured backend
+
+    all-MiniLM-L6-v2 ships ONNX and quantized ONNX files on the Hub; for other models create one
+    with sentence_transformers.export_dynamic_quantized_onnx_model and point EMBEDDING_ONNX_INT8_FILE at it.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    backend = backend or EMBEDDING_BACKEND
+    model_name = model_name or EMBEDDING_MODEL
+    if backend == 'torch':
+        return SentenceTransformer(model_name)
+    if backend == 'onnx':
+        return SentenceTransformer(model_name, backend='onnx')
+    if backend == 'onnx-int8':
+        return SentenceTransformer(model_name, backend='onnx', model_kwargs={'file_name': EMBEDDING_ONNX_INT8_FILE})
+    raise ValueError(f"Unknown embedding backend '{backend}', expected one of {list(EMBEDDING_BACKENDS)}")
+
+
+def model_normalizes(model):
+    """Whether a SentenceTransformer L2-normalizes its embeddings (a Normalize module in its pipeline)"""
+    return any(type(module).__name__ == 'Normalize' for module in model)
+
+
+class EmbeddingClient:
+    """SentenceTransformer-style encode() served by embedding_server.py
+
+    Falls back to the in-process model (loaded on first need) while the server is unreachable.
+    """
+
+    def __init__(self, url=EMBEDDING_SERVER_URL, timeout=EMBEDDING_SERVER_TIMEOUT):
+        parts = urlsplit(url)
+        self.url = url
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self._local = threading.local()  # one keep-alive connection per thread
+        self._down_until = 0.0
+        self.remote_calls = 0
+        self.fallback_calls = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def _discard_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def health(self, timeout=0.5):
+        """Server status dict, or None when it is not reachable"""
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+        try:
+            conn.request('GET', '/health')
+            response = conn.getresponse()
+            return json.loads(response.read()) if response.status == 200 else None
+        except (OSError, http.client.HTTPException, ValueError):
+            return None
+        finally:
+            conn.close()
+
+    def available(self):
+        """Whether the server is up and embeds exactly as the in-process model would"""
+        health = self.health()
+        if health is None:
+            return False
+        expected = {'model': EMBEDDING_MODEL, 'backend': EMBEDDING_BACKEND, 'dimensions': EMBEDDING_DIMENSIONS,
+                    'normalized': EMBEDDING_NORMALIZED}
+        mismatches = [f"{key} {health.get(key)!r} (expected {value!r})"
+                      for key, value in expected.items() if health.get(key) != value]
+        if mismatches:
+            logger.warning("Embedding server at %s does not match this configuration: %s; using the in-process model",
+                           self.url, ', '.join(mismatches))
+            return False
+        return True
+
+    def _post(self, texts, normalize=False):
+        body = json.dumps({'texts': texts, 'normalize': normalize})
+        conn = self._connection()
+        try:
+            conn.request('POST', '/embed', body=body, headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+        except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+            # An idle keep-alive connection was closed by the server; retry once on a new one
+            self._discard_connection()
+            conn = self._connection()
+            conn.request('POST', '/embed', body=body, headers={'Content-Type': 'application/json'})
+            response = conn.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise http.client.HTTPException(f"embedding server returned {response.status}: {body[:200]!r}")
+        dimensions = int(response.getheader('X-Embedding-Dimensions'))
+        return np.frombuffer(body, dtype='<f4').reshape(len(texts), dimensions).astype(np.float32)
+
+    def _encode_remote(self, texts, normalize=False):
+        if time.monotonic() < self._down_until:
+            return None
+        try:
+            chunks = [self._post(texts[start:start + SERVER_MAX_TEXTS], normalize)
+                      for start in range(0, len(texts), SERVER_MAX_TEXTS)]
+        except (OSError, http.client.HTTPException) as e:
+            self._discard_connection()
+            self._down_until = time.monotonic() + SERVER_RETRY_SECONDS
+            logger.warning("Embedding server at %s unavailable (%s); using the in-process model", self.url, e)
+            return None
+        self.remote_calls += 1
+        return np.concatenate(chunks)
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False, convert_to_numpy=True):
+        """SentenceTransformer.encode for the options this client supports
+
+        `normalize_embeddings` is applied by the server; `batch_size` only sizes the in-process fallback's
+        batches, since the server forms its own batches across concurrent requests. Results are always
+        NumPy arrays.
+        """
+        if not convert_to_numpy:
+            raise ValueError("EmbeddingClient.encode only returns NumPy arrays (convert_to_numpy=True)")
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        embeddings = self._encode_remote(texts, normalize_embeddings)
+        if embeddings is None:
+            self.fallback_calls += 1
+            embeddings = get_local_model().encode(texts, batch_size=batch_size,
+                                                  normalize_embeddings=normalize_embeddings)
+        return embeddings[0] if single else embeddings
+
+
+_model = None
+_local_model = None
+_model_lock = threading.Lock()
+
+
+def get_local_model():
+    """In-process embedding model, loaded (and torch imported) on first use only"""
+    global _local_model
+    if _local_model is None:
+        with _model_lock:
+            if _local_model is None:
+                _local_model = load_model()
+    return _local_model
+
+
+def get_model():
+    """Process-wide embedding model: the local embedding server if it answers, else the in-process model"""
+    global _model
+    if _model is None:
+        client = EmbeddingClient() if EMBEDDING_SERVER_URL else None
+        model = client if client is not None and client.available() else get_local_model()
+        with _model_lock:
+            if _model is None:
+                _model = model
+    return _model
+
+
+def describe_model(model=None):
+    """Where embeddings come from, for status lines"""
+    model = _model if model is None else model
+    if model is None:
+        return "Embeddings: not loaded"
+    if isinstance(model, EmbeddingClient):
+        return (f"Embeddings: server {model.url} ({model.remote_calls} calls, "
+                f"{model.fallback_calls} in-process fallbacks)")
+    return f"Embeddings: in-process {EMBEDDING_MODEL} ({EMBEDDING_BACKEND})"
+
+
+def normalize_query(text):
+    """Cache key for a query: collapsed whitespace, and lowercased when EMBEDDING_UNCASED
+
+    Lowercasing only merges queries that embed identically, so it is limited to uncased tokenizers.
+    """
+    text = ' '.join(text.split())
+    return text.lower() if EMBEDDING_UNCASED else text
+
+
+class EmbeddingCache:
+    """Bounded, thread-safe LRU map of normalized query text -> embedding (numpy array)"""
+
+    def __init__(self, maxsize=QUERY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, key, embedding):
+        embedding.setflags(write=False)  # shared between callers, so never modified in place
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+query_cache = EmbeddingCache()
+
+
+def encode_query(model, text):
+    """Embedding for a search query, skipping model inference for repeated queries"""
+    key = normalize_query(text)
+    with span('embed') as fields:
+        embedding = query_cache.get(key)
+        fields['cached'] = embedding is not None
+        if embedding is None:
+            embedding = model.encode(key)
+            query_cache.put(key, embedding)
+    return embedding
+
+
+def format_cache_stats(stats=None):
+    stats = query_cache.stats() if stats is None else stats
+    return (f"Query embedding cache: {stats['hits']} hits / {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%}), {stats['size']}/{stats['max_size']} entries")
@@ -0,0 +1,251 @@
+# Retrieval quality and latency evaluation over a labeled query set
+#
+#   python evaluate.py                                    # every mode, report in eval_report.json
+#   python evaluate.py --modes search_docs semantic -k 6
+#   python evaluate.py --output after.json --compare eval_report.json
+#
+# Each query has one relevant document: hand-written questions plus questions generated from the
+# mock ServiceNow incidents (their "Symptoms:" line) and runbooks (the first sentence of their
+# overview), labeled with that document's URL. Run the loaders first so those documents exist.
+#
+# Modes are the searches the applications run (search_docs for the web UI, search_blog for the
+# agent) and alternatives to compare them against. Latency is end to end per query: embedding,
+# SQL, rerank and MMR; the query embedding cache is cleared before every run so each one embeds.
+import argparse
+import json
+import math
+import re
+import statistics
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from dotenv import load_dotenv
+import db
+from embeddings import EMBEDDING_BACKEND, EMBEDDING_MODEL, describe_model, encode_query, get_model, query_cache
+from fusion import get_fusion
+from load_runbooks import MOCK_RUNBOOKS
+from load_servicenow_mock import MOCK_INCIDENTS
+from mmr import MMR_CANDIDATES, MMR_LAMBDA, MMR_MIN_PER_SOURCE
+from rerank import RERANK_CANDIDATES, RERANK_ENABLED, RERANK_MODEL, Reranker
+from retrieval import FILTER_STRATEGY, extract_keywords, hybrid_search, search_docs, semantic_search
+
+load_dotenv()
+
+# Questions with the document that answers them (mock ServiceNow incidents and runbooks)
+LABELED_QUERIES = [
+    ("Why did CPU spike to 98% on the production SQL Server?", "https://company.service-now.com/incident.do?sys_id=12345"),
+    ("tempdb filled up and blocked every transaction", "https://company.service-now.com/incident.do?sys_id=12456"),
+    ("deadlocks causing failed transactions", "https://company.service-now.com/incident.do?sys_id=12567"),
+    ("primary node stopped responding and the availability group failed over", "https://company.service-now.com/incident.do?sys_id=12678"),
+    ("SQL Server consuming all the memory on the host", "https://company.service-now.com/incident.do?sys_id=12789"),
+    ("transaction log is full and cannot process transactions", "https://company.service-now.com/incident.do?sys_id=12890"),
+    ("recurring tempdb growth problem record", "https://company.service-now.com/problem.do?sys_id=1234"),
+    ("blocking chain delaying order processing", "https://company.service-now.com/incident.do?sys_id=12991"),
+    ("log backup chain was broken and backups failed", "https://company.service-now.com/incident.do?sys_id=13213"),
+    ("application ran out of connections in the pool", "https://company.service-now.com/incident.do?sys_id=13546"),
+    ("parameter sniffing made queries intermittently slow", "https://company.service-now.com/incident.do?sys_id=13657"),
+    ("CHECKDB found corruption during weekly maintenance", "https://company.service-now.com/incident.do?sys_id=13980"),
+    ("How is the DR environment set up between Atlanta and Phoenix?", "https://company.sharepoint.com/sites/IT/DR-Architecture"),
+    ("How do I get production database access?", "https://company.sharepoint.com/sites/Security/Production-Access"),
+    ("steps to fail over to the DR site", "https://company.sharepoint.com/sites/DBA/DR-Failover"),
+    ("how do we promote code from QA to production", "https://company.sharepoint.com/sites/Engineering/Code-Promotion"),
+]
+
+DEFAULT_K = 6
+DEFAULT_REPEAT = 3  # latency samples per query and mode (metrics are taken from the first run)
+
+_OVERVIEW = re.compile(r'\*\*Overview:\*\*\s*(.+?)(?:\.\s|\n\s*\n)', re.DOTALL)
+
+
+def incident_query(incident):
+    """What a user would type when the incident happens again: its symptoms, or its title"""
+    for line in incident['description'].splitlines():
+        if line.startswith('Symptoms:'):
+            return line[len('Symptoms:'):].strip()
+    return re.sub(r'^\[\w+\]\s*', '', incident['title'])
+
+
+def runbook_query(runbook):
+    match = _OVERVIEW.search(runbook['description'])
+    return ' '.join(match.group(1).split()) if match else runbook['title']
+
+
+def labeled_queries():
+    """(kind, question, relevant url) for the hand-written and the generated questions"""
+    queries = [('curated', question, url) for question, url in LABELED_QUERIES]
+    queries += [('incident', incident_query(incident), incident['url']) for incident in MOCK_INCIDENTS]
+    queries += [('runbook', runbook_query(runbook), runbook['url']) for runbook in MOCK_RUNBOOKS]
+    return queries
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def ranking_metrics(ranked_urls, expected_url, k):
+    """recall@k, reciprocal rank and nDCG@k for a single relevant document"""
+    rank = ranked_urls.index(expected_url) + 1 if expected_url in ranked_urls else None
+    return {
+        'recall': 1.0 if rank is not None and rank <= k else 0.0,
+        'mrr': 1.0 / rank if rank is not None else 0.0,
+        'ndcg': 1.0 / math.log2(rank + 1) if rank is not None and rank <= k else 0.0,
+    }
+
+
+def mean_metrics(metrics):
+    return {name: round(statistics.mean(m[name] for m in metrics), 4) for name in ('recall', 'mrr', 'ndcg')}
+
+
+def latency_summary(latencies):
+    return {
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'mean_ms': round(statistics.mean(latencies), 2),
+    }
+
+
+# ============================================
+# MODES: question -> ranked results
+# ============================================
+
+def run_hybrid(question, k):
+    with db.cursor() as cur:
+        return hybrid_search(cur, encode_query(get_model(), question), extract_keywords(question), k)
+
+
+def run_semantic(question, k):
+    with db.cursor() as cur:
+        return semantic_search(cur, encode_query(get_model(), question), k)
+
+
+def run_search_blog(question, k):
+    from agent_app import search_blog_results
+    return search_blog_results(question, k)
+
+
+_forced_reranker = None
+
+
+def forced_reranker():
+    global _forced_reranker
+    if _forced_reranker is None:
+        _forced_reranker = Reranker()
+    return _forced_reranker
+
+
+MODES = {
+    'search_docs': lambda question, k: search_docs(question, k),
+    'search_docs:rrf': lambda question, k: search_docs(question, k, fusion=get_fusion('rrf'), reranker=False),
+    'search_docs:weighted': lambda question, k: search_docs(question, k, fusion=get_fusion('weighted'), reranker=False),
+    'search_docs:rerank': lambda question, k: search_docs(question, k, reranker=forced_reranker()),
+    'search_docs:no-source-query': lambda question, k: search_docs(question, k, per_source=False),
+    'search_blog': run_search_blog,
+    'hybrid': run_hybrid,
+    'semantic': run_semantic,
+}
+
+
+def evaluate_mode(run, queries, k, repeat):
+    per_query = []
+    latencies = []
+    for kind, question, url in queries:
+        timings = []
+        for attempt in range(repeat):
+            query_cache.clear()
+            started = time.perf_counter()
+            results = run(question, k)
+            timings.append((time.perf_counter() - started) * 1000)
+            if attempt == 0:
+                ranked = [r.url for r in results]
+        latencies.extend(timings)
+        per_query.append(dict(kind=kind, question=question, url=url, rank=ranked.index(url) + 1 if url in ranked else None,
+                              **ranking_metrics(ranked, url, k)))
+
+    by_kind = defaultdict(list)
+    for entry in per_query:
+        by_kind[entry['kind']].append(entry)
+    return {
+        'metrics': mean_metrics(per_query),
+        'by_kind': {kind: mean_metrics(entries) for kind, entries in sorted(by_kind.items())},
+        'latency': latency_summary(latencies),
+        'misses': [{'question': e['question'], 'url': e['url']} for e in per_query if not e['recall']],
+    }
+
+
+def configuration(args):
+    fusion = get_fusion()
+    return {
+        'k': args.k,
+        'repeat': args.repeat,
+        'embedding_model': EMBEDDING_MODEL,
+        'embedding_backend': EMBEDDING_BACKEND,
+        'embedding': describe_model(),
+        'fusion': list(fusion.signature()),
+        'filter_strategy': FILTER_STRATEGY,
+        'mmr': {'lambda': MMR_LAMBDA, 'min_per_source': MMR_MIN_PER_SOURCE, 'candidates': MMR_CANDIDATES},
+        'rerank': {'enabled': RERANK_ENABLED, 'model': RERANK_MODEL, 'candidates': RERANK_CANDIDATES},
+    }
+
+
+def print_report(report, baseline=None):
+    print(f"\n{report['queries']} labeled queries, k={report['config']['k']}\n")
+    print(f"{'mode':<22}{'recall@k':>10}{'MRR':>8}{'nDCG@k':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for mode, result in report['modes'].items():
+        metrics, latency = result['metrics'], result['latency']
+        print(f"{mode:<22}{metrics['recall']:>10.3f}{metrics['mrr']:>8.3f}{metrics['ndcg']:>9.3f}"
+              f"{latency['p50_ms']:>9.1f}{latency['p95_ms']:>9.1f}{latency['p99_ms']:>9.1f}")
+        previous = (baseline or {}).get('modes', {}).get(mode)
+        if previous:
+            old_metrics, old_latency = previous['metrics'], previous['latency']
+            print(f"{'  vs baseline':<22}{metrics['recall'] - old_metrics['recall']:>+10.3f}"
+                  f"{metrics['mrr'] - old_metrics['mrr']:>+8.3f}{metrics['ndcg'] - old_metrics['ndcg']:>+9.3f}"
+                  f"{latency['p50_ms'] - old_latency['p50_ms']:>+9.1f}{latency['p95_ms'] - old_latency['p95_ms']:>+9.1f}"
+                  f"{latency['p99_ms'] - old_latency['p99_ms']:>+9.1f}")
+
+    for mode, result in report['modes'].items():
+        by_kind = ', '.join(f"{kind} {metrics['recall']:.2f}" for kind, metrics in result['by_kind'].items())
+        print(f"\n{mode}: recall@k by kind: {by_kind}; {len(result['misses'])} misses")
+        for miss in result['misses'][:5]:
+            print(f"  - {miss['question'][:70]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval quality and latency over the labeled query set")
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('-k', type=int, default=DEFAULT_K)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--output', default='eval_report.json', help="JSON report to write")
+    parser.add_argument('--compare', help="earlier JSON report to print deltas against")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    queries = labeled_queries()
+    model = get_model()
+    model.encode("warm up")
+
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'queries': len(queries),
+        'config': configuration(args),
+        'modes': {},
+    }
+    for mode in args.modes:
+        print(f"Evaluating {mode}...", file=sys.stderr)
+        MODES[mode](queries[0][1], args.k)  # warm up (models, prepared statements, pool)
+        report['modes'][mode] = evaluate_mode(MODES[mode], queries, args.k, args.repeat)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print_report(report, baseline)
+    print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
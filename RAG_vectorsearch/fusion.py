@@ -0,0 +1,88 @@
+# Score fusion for hybrid retrieval
+#
+# Each retriever produces a ranked candidate list. A fusion strategy turns the per-retriever
+# ranks/scores into one score inside the retrieval SQL (sql_score), where every retriever <name>
+# exposes <name>_rank and <name>_score columns.
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+FUSION_METHOD = os.getenv('FUSION_METHOD', 'rrf')
+RRF_K = int(os.getenv('FUSION_RRF_K', '60'))
+
+
+def parse_weights(text):
+    """'semantic=1.0,keyword=0.5' -> {'semantic': 1.0, 'keyword': 0.5}"""
+    weights = {}
+    for part in (text or '').split(','):
+        if '=' in part:
+            name, value = part.split('=', 1)
+            weights[name.strip()] = float(value)
+    return weights
+
+
+DEFAULT_WEIGHTS = parse_weights(os.getenv('FUSION_WEIGHTS', 'semantic=1.0,keyword=1.0'))
+
+
+class ReciprocalRankFusion:
+    """score = sum(weight / (k + rank)), normalized so a first place in every retriever scores 1.0"""
+
+    name = 'rrf'
+
+    def __init__(self, k=RRF_K, weights=None):
+        self.k = k
+        self.weights = dict(DEFAULT_WEIGHTS if weights is None else weights)
+
+    def weight(self, retriever):
+        return self.weights.get(retriever, 1.0)
+
+    def signature(self):
+        return self.name, self.k, tuple(sorted(self.weights.items()))
+
+    def sql_score(self, retrievers):
+        terms = []
+        params = []
+        for retriever in retrievers:
+            terms.append(f"COALESCE(%s::float / (%s::float + {retriever}_rank), 0)")
+            params.extend([self.weight(retriever), self.k])
+        best = sum(self.weight(r) for r in retrievers) / (self.k + 1) or 1.0
+        return f"({' + '.join(terms)}) / %s::float", params + [best]
+
+
+class WeightedScoreFusion:
+    """score = weighted mean of the retrievers' own scores (0 when a retriever missed the document)"""
+
+    name = 'weighted'
+
+    def __init__(self, weights=None):
+        self.weights = dict(DEFAULT_WEIGHTS if weights is None else weights)
+
+    def weight(self, retriever):
+        return self.weights.get(retriever, 1.0)
+
+    def signature(self):
+        return self.name, tuple(sorted(self.weights.items()))
+
+    def sql_score(self, retrievers):
+        terms = []
+        params = []
+        for retriever in retrievers:
+            terms.append(f"COALESCE(%s::float * {retriever}_score, 0)")
+            params.append(self.weight(retriever))
+        total_weight = sum(self.weight(r) for r in retrievers) or 1.0
+        return f"({' + '.join(terms)}) / %s::float", params + [total_weight]
+
+
+FUSION_STRATEGIES = {
+    ReciprocalRankFusion.name: ReciprocalRankFusion,
+    WeightedScoreFusion.name: WeightedScoreFusion,
+}
+
+
+def get_fusion(method=None, **kwargs):
+    """Fusion strategy by name (defaults to FUSION_METHOD)"""
+    method = method or FUSION_METHOD
+    if method not in FUSION_STRATEGIES:
+        raise ValueError(f"Unknown fusion method '{method}', expected one of {sorted(FUSION_STRATEGIES)}")
+    return FUSION_STRATEGIES[method](**kwargs)
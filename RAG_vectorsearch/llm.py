@@ -0,0 +1,172 @@
+# Claude answers for the web UI: prompt building, blocking and streaming calls
+#
+# Point ANTHROPIC_BASE_URL at llm_stub.py to run without the real API:
+#   python llm_stub.py --port 8765
+#   ANTHROPIC_BASE_URL=http://127.0.0.1:8765 python llm.py "Any incidents on AlwaysOn?"
+import sys
+import time
+import os
+from dotenv import load_dotenv
+import answer_cache
+import db
+from context_packer import CONTEXT_TOKEN_BUDGET, estimate_tokens, pack_context
+from retrieval import fetch_content
+from timing import logger, span
+
+load_dotenv()
+
+CLAUDE_MODEL = os.getenv('CLAUDE_MODEL', 'claude-sonnet-4-20250514')
+MAX_TOKENS = 300
+
+# Map source to label
+SOURCE_LABELS = {
+    'blog': '📚 Blog Post',
+    'documentation': '📗 Runbook',
+    'microsoft': '📘 Microsoft Docs',
+    'servicenow': '🎫 ServiceNow Incident'
+}
+
+
+def create_client():
+    # The SDK (and httpx) are imported here so entry points only pay for them when they call Claude
+    from anthropic import Anthropic
+    import httpx
+
+    # Fix proxy issue by providing custom httpx client
+    try:
+        return Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY'))
+    except TypeError:
+        return Anthropic(
+            api_key=os.getenv('ANTHROPIC_API_KEY'),
+            http_client=httpx.Client()
+        )
+
+
+def build_prompt(question, results):
+    context = "\n\n---\n\n".join([
+        f"{SOURCE_LABELS.get(r.source, r.source)}: {r.title}\n\nContent: {r.content}\n\nURL: {r.url}"
+        for r in results
+    ])
+
+    return f"""You are a helpful SQL Server expert. Answer the user's question based on these resources.
+
+RESOURCES:
+{context}
+
+QUESTION: {question}
+
+Keep your answer to 2-3 sentences max. Be concise and direct. End with "Elaborate?" if more detail would help."""
+
+
+def with_content(results):
+    """Late fetch: search results arrive without content, load it only when a prompt needs it"""
+    if all(r.content is not None for r in results):
+        return results
+    with db.cursor() as cur:
+        return fetch_content(cur, results)
+
+
+def prepare_prompt(question, results, question_embedding, sentence_model=None, report=None):
+    """Prompt for a cache miss; packs the context into CONTEXT_TOKEN_BUDGET when a sentence model is given"""
+    results = with_content(results)
+    if sentence_model is not None and CONTEXT_TOKEN_BUDGET > 0:
+        results = pack_context(sentence_model, question_embedding, results, CONTEXT_TOKEN_BUDGET)
+    prompt = build_prompt(question, results)
+    if report is not None:
+        report['prompt_tokens_estimated'] = estimate_tokens(prompt)
+    return prompt
+
+
+def record_usage(report, usage):
+    """Token counts reported by the API for this request"""
+    if report is not None and usage is not None:
+        report['input_tokens'] = usage.input_tokens
+        report['output_tokens'] = usage.output_tokens
+    if usage is not None:
+        logger.debug("Prompt tokens: %s, answer tokens: %s", usage.input_tokens, usage.output_tokens)
+
+
+def ask_claude(client, question, results, question_embedding, sentence_model=None, report=None):
+    """Blocking answer; reused from the answer cache for near-identical questions over the same documents
+
+    `report` (a dict) receives cache/token statistics for the request.
+    """
+    doc_ids = [r.id for r in results]
+    cached_answer = answer_cache.lookup(question_embedding, doc_ids, CLAUDE_MODEL)
+    if report is not None:
+        report['cached'] = cached_answer is not None
+    if cached_answer is not None:
+        return cached_answer
+
+    prompt = prepare_prompt(question, results, question_embedding, sentence_model, report)
+    with span('claude', model=CLAUDE_MODEL, stream=False) as fields:
+        message = client.messages.create(
+            model=CLAUDE_MODEL,
+            max_tokens=MAX_TOKENS,
+            messages=[{"role": "user", "content": prompt}]
+        )
+        fields['output_tokens'] = message.usage.output_tokens
+    record_usage(report, message.usage)
+
+    answer = message.content[0].text
+    answer_cache.store(question, question_embedding, doc_ids, CLAUDE_MODEL, answer)
+    return answer
+
+
+def stream_claude(client, question, results, question_embedding, sentence_model=None, report=None):
+    """Yield answer text as it arrives from the streaming Messages API (cached answers in one piece)"""
+    doc_ids = [r.id for r in results]
+    cached_answer = answer_cache.lookup(question_embedding, doc_ids, CLAUDE_MODEL)
+    if report is not None:
+        report['cached'] = cached_answer is not None
+    if cached_answer is not None:
+        yield cached_answer
+        return
+
+    prompt = prepare_prompt(question, results, question_embedding, sentence_model, report)
+    chunks = []
+    # The span includes the time the caller spends rendering chunks between reads
+    with span('claude', model=CLAUDE_MODEL, stream=True) as fields, client.messages.stream(
+        model=CLAUDE_MODEL,
+        max_tokens=MAX_TOKENS,
+        messages=[{"role": "user", "content": prompt}]
+    ) as stream:
+        started = time.perf_counter()
+        for text in stream.text_stream:
+            if not chunks:
+                fields['first_token_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            chunks.append(text)
+            yield text
+        usage = stream.get_final_message().usage
+        fields['output_tokens'] = usage.output_tokens
+        record_usage(report, usage)
+
+    answer_cache.store(question, question_embedding, doc_ids, CLAUDE_MODEL, ''.join(chunks))
+
+
+def main():
+    """Stream one answer to stdout (no retrieval) and report time to first token"""
+    question = ' '.join(sys.argv[1:]) or "Any incidents on AlwaysOn?"
+    client = create_client()
+
+    started = time.perf_counter()
+    first_token = None
+    chunks = []
+    with client.messages.stream(
+        model=CLAUDE_MODEL,
+        max_tokens=MAX_TOKENS,
+        messages=[{"role": "user", "content": build_prompt(question, [])}]
+    ) as stream:
+        for text in stream.text_stream:
+            if first_token is None:
+                first_token = time.perf_counter() - started
+            chunks.append(text)
+            print(text, end='', flush=True)
+
+    total = time.perf_counter() - started
+    print(f"\n\nfirst token: {first_token * 1000 if first_token else 0:.0f} ms, "
+          f"complete: {total * 1000:.0f} ms, {len(chunks)} chunks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+# Local stand-in for the Anthropic Messages API (blocking JSON and server-sent events)
+#
+#   python llm_stub.py --port 8765 --first-token-ms 400 --tokens-per-sec 60
+#   python llm_stub.py --profile slow --error-rate 0.02
+#   ANTHROPIC_BASE_URL=http://127.0.0.1:8765 ANTHROPIC_API_KEY=stub streamlit run app_conversational.py
+#
+# A profile sets the first-token delay, token rate and jitter; explicit flags override it.
+# With --error-rate, that fraction of requests fails with 529 overloaded_error like the real API.
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ANSWER = ("Based on the incident history, this was caused by a missing index that forced "
+                  "table scans on a high-volume query. Creating a covering index brought CPU back "
+                  "to normal within minutes. Elaborate?")
+
+
+# Latency profiles: first_token_ms, tokens_per_sec, jitter (+/- fraction applied to both per request)
+PROFILES = {
+    'instant': dict(first_token_ms=0.0, tokens_per_sec=10000.0, jitter=0.0),
+    'fast': dict(first_token_ms=250.0, tokens_per_sec=120.0, jitter=0.2),
+    'default': dict(first_token_ms=400.0, tokens_per_sec=60.0, jitter=0.0),
+    'slow': dict(first_token_ms=1500.0, tokens_per_sec=30.0, jitter=0.4),
+}
+
+
+class StubConfig:
+    def __init__(self, first_token_ms=400.0, tokens_per_sec=60.0, answer=DEFAULT_ANSWER, jitter=0.0, error_rate=0.0):
+        self.first_token_ms = first_token_ms
+        self.tokens_per_sec = tokens_per_sec
+        self.answer = answer
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._stats_lock = threading.Lock()
+        self.active = 0
+        self.peak_active = 0
+        self.requests = 0
+        self.errors = 0
+
+    @classmethod
+    def from_profile(cls, name, **overrides):
+        settings = dict(PROFILES[name])
+        settings.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(**settings)
+
+    def sample(self):
+        """(first token seconds, seconds per token) for one request, jittered"""
+        factor = 1.0 + random.uniform(-self.jitter, self.jitter) if self.jitter else 1.0
+        return self.first_token_ms * factor / 1000.0, 1.0 / (self.tokens_per_sec / factor)
+
+    def started(self):
+        with self._stats_lock:
+            self.requests += 1
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+            failed = random.random() < self.error_rate
+            self.errors += failed
+        return failed
+
+    def finished(self):
+        with self._stats_lock:
+            self.active -= 1
+
+    def stats(self):
+        with self._stats_lock:
+            return {'requests': self.requests, 'errors': self.errors, 'active': self.active,
+                    'peak_active': self.peak_active}
+
+
+def split_tokens(text):
+    """Rough word-level tokens; spaces stay attached so the chunks concatenate back to the text"""
+    words = text.split(' ')
+    return [word if i == len(words) - 1 else word + ' ' for i, word in enumerate(words)]
+
+
+def estimate_input_tokens(body):
+    text = ''.join(
+        m['content'] if isinstance(m['content'], str) else ''.join(b.get('text', '') for b in m['content'])
+        for m in body.get('messages', [])
+    )
+    return max(1, len(text) // 4)
+
+
+class MessagesHandler(BaseHTTPRequestHandler):
+    config = StubConfig()
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass  # keep the console quiet under load
+
+    def do_POST(self):
+        if not self.path.startswith('/v1/messages'):
+            self.send_error(404)
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        tokens = split_tokens(self.config.answer)
+        input_tokens = estimate_input_tokens(body)
+        message_id = f"msg_stub_{uuid.uuid4().hex[:12]}"
+        model = body.get('model', 'stub')
+        first_token, per_token = self.config.sample()
+
+        failed = self.config.started()
+        try:
+            time.sleep(first_token)
+            if failed:
+                self.error_response(529, 'overloaded_error', 'Overloaded (stub)')
+            elif body.get('stream'):
+                self.stream_response(message_id, model, tokens, input_tokens, per_token)
+            else:
+                time.sleep(len(tokens) * per_token)
+                self.json_response(message_id, model, tokens, input_tokens)
+        finally:
+            self.config.finished()
+
+    def error_response(self, status, error_type, message):
+        payload = json.dumps({'type': 'error', 'error': {'type': error_type, 'message': message}}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def json_response(self, message_id, model, tokens, input_tokens):
+        payload = json.dumps({
+            'id': message_id,
+            'type': 'message',
+            'role': 'assistant',
+            'model': model,
+            'content': [{'type': 'text', 'text': ''.join(tokens)}],
+            'stop_reason': 'end_turn',
+            'stop_sequence': None,
+            'usage': {'input_tokens': input_tokens, 'output_tokens': len(tokens)},
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_event(self, event, data):
+        chunk = f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+        self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+        self.wfile.flush()
+
+    def stream_response(self, message_id, model, tokens, input_tokens, per_token):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        self.send_event('message_start', {
+            'type': 'message_start',
+            'message': {
+                'id': message_id, 'type': 'message', 'role': 'assistant', 'model': model,
+                'content': [], 'stop_reason': None, 'stop_sequence': None,
+                'usage': {'input_tokens': input_tokens, 'output_tokens': 1},
+            },
+        })
+        self.send_event('content_block_start', {
+            'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''},
+        })
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(per_token)
+            self.send_event('content_block_delta', {
+                'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': token},
+            })
+        self.send_event('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+        self.send_event('message_delta', {
+            'type': 'message_delta',
+            'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+            'usage': {'output_tokens': len(tokens)},
+        })
+        self.send_event('message_stop', {'type': 'message_stop'})
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def serve(host, port, config):
+    MessagesHandler.config = config
+    server = ThreadingHTTPServer((host, port), MessagesHandler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Anthropic Messages API stub")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--profile', choices=list(PROFILES), default='default')
+    parser.add_argument('--first-token-ms', type=float)
+    parser.add_argument('--tokens-per-sec', type=float)
+    parser.add_argument('--jitter', type=float)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--answer', default=DEFAULT_ANSWER)
+    args = parser.parse_args()
+
+    config = StubConfig.from_profile(args.profile, first_token_ms=args.first_token_ms,
+                                     tokens_per_sec=args.tokens_per_sec, jitter=args.jitter,
+                                     error_rate=args.error_rate, answer=args.answer)
+    server = serve(args.host, args.port, config)
+    print(f"Anthropic stub listening on http://{args.host}:{args.port} "
+          f"({args.profile}: first token {config.first_token_ms:.0f} ms, {config.tokens_per_sec:.0f} tokens/s, "
+          f"jitter {config.jitter:.0%}, errors {config.error_rate:.0%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,22 @@
-import psycopg2
-from pgvector.psycopg2 import register_vector
-from sentence_transformers import SentenceTransformer
-import os
 from dotenv import load_dotenv
+import db
+from embeddings import get_model
 import requests
 from bs4 import BeautifulSoup
 import time
 
 load_dotenv()
 
-# Load model
-print("Loading embedding model...")
-model = SentenceTransformer('all-MiniLM-L6-v2')
-print("✅ Model loaded\n")
+def load_embedding_model():
+    """Loaded only when there is something new to embed (reruns with nothing new skip torch entirely)"""
+    print("Loading embedding model...")
+    model = get_model()
+    print("✅ Model loaded\n")
+    return model
+
+# Fetched docs are embedded, copied and committed in batches of this size, so an interrupted crawl
+# keeps what it already stored and a rerun skips those URLs
+STORE_BATCH_SIZE = 5
 
 # Curated list of important Microsoft SQL Server docs
 MICROSOFT_DOCS = [
@@ -105,46 +109,26 @@ def scrape_microsoft_doc(url):
         print(f"  ❌ Error: {e}")
         return None, None
 
-def store_in_database(title, content, url, source='microsoft'):
-    """Store document in database"""
-    
-    if not content or len(content) < 100:
-        print(f"  ⚠️  Content too short, skipping")
-        return False
-    
-    conn = psycopg2.connect(
-        host=os.getenv('DB_HOST'),
-        database=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        port=os.getenv('DB_PORT')
-    )
-    register_vector(conn)
-    cur = conn.cursor()
-    
-    # Check if exists
-    cur.execute("SELECT id FROM sql_docs WHERE url = %s", (url,))
-    if cur.fetchone():
-        cur.close()
-        conn.close()
-        return False
-    
-    # Generate embedding
-    print(f"  🔢 Generating embedding...")
-    text = f"{title} {content}"
-    embedding = model.encode(text).tolist()
-    
-    # Insert
-    print(f"  💾 Storing in database...")
-    cur.execute("""
-        INSERT INTO sql_docs (title, content, url, embedding, source)
-        VALUES (%s, %s, %s, %s, %s)
-    """, (title, content, url, embedding, source))
-    
-    conn.commit()
-    cur.close()
-    conn.close()
-    return True
+def store_in_database(docs, model, source='microsoft'):
+    """Store one batch of scraped (title, content, url) documents; committed when the cursor is returned"""
+    
+    if not docs:
+        return 0
+    
+    with db.cursor() as cur:
+        # Generate embeddings in one batch (numpy arrays, sent as binary vectors)
+        print(f"🔢 Generating {len(docs)} embeddings...")
+        embeddings = model.encode([f"{title} {content}" for title, content, url in docs], batch_size=32)
+        
+        # Insert with binary COPY
+        print(f"💾 Storing in database...\n")
+        db.copy_rows(cur, 'sql_docs', ('title', 'content', 'url', 'embedding', 'source'), [
+            (title, content, url, embedding, source)
+            for (title, content, url), embedding in zip(docs, embeddings)
+        ])
+        db.notify_docs_changed(cur, source)
+    
+    return len(docs)
 
 def main():
     print("="*70)
@@ -154,42 +138,40 @@ def main():
     
     # Check if source column exists
     print("Checking database schema...")
-    conn = psycopg2.connect(
-        host=os.getenv('DB_HOST'),
-        database=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        port=os.getenv('DB_PORT')
-    )
-    cur = conn.cursor()
-    
-    # Check if source column exists
-    cur.execute("""
-        SELECT column_name 
-        FROM information_schema.columns 
-        WHERE table_name='sql_docs' AND column_name='source'
-    """)
-    
-    if not cur.fetchone():
-        print("⚠️  Adding 'source' column to database...")
-        cur.execute("ALTER TABLE sql_docs ADD COLUMN source VARCHAR(50) DEFAULT 'blog'")
-        cur.execute("UPDATE sql_docs SET source = 'blog' WHERE source IS NULL")
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_source ON sql_docs(source)")
-        conn.commit()
-        print("✅ Database updated\n")
-    else:
-        print("✅ Database schema OK\n")
-    
-    cur.close()
-    conn.close()
+    with db.cursor() as cur:
+        # Check if source column exists
+        cur.execute("""
+            SELECT column_name 
+            FROM information_schema.columns 
+            WHERE table_name='sql_docs' AND column_name='source'
+        """)
+        
+        if not cur.fetchone():
+            print("⚠️  Adding 'source' column to database...")
+            cur.execute("ALTER TABLE sql_docs ADD COLUMN source VARCHAR(50) DEFAULT 'blog'")
+            cur.execute("UPDATE sql_docs SET source = 'blog' WHERE source IS NULL")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_source ON sql_docs(source)")
+            db.notify_docs_changed(cur, '')  # empty payload: every cached search is affected
+            print("✅ Database updated\n")
+        else:
+            print("✅ Database schema OK\n")
+        
+        existing = db.existing_urls(cur, MICROSOFT_DOCS)
     
-    successful = 0
     skipped = 0
     failed = 0
+    successful = 0
+    pending = []
+    model = None
     
     for i, url in enumerate(MICROSOFT_DOCS, 1):
         print(f"[{i}/{len(MICROSOFT_DOCS)}] Processing: {url}")
         
+        if url in existing:
+            print(f"  ⏭️  Already exists\n")
+            skipped += 1
+            continue
+        
         title, content = scrape_microsoft_doc(url)
         
         if not title or not content:
@@ -200,16 +182,27 @@ def main():
         display_title = title[:60] + "..." if len(title) > 60 else title
         print(f"  📝 Title: {display_title}")
         
-        if store_in_database(title, content, url, source='microsoft'):
-            print(f"  ✅ Successfully stored\n")
-            successful += 1
-        else:
-            print(f"  ⏭️  Already exists or skipped\n")
+        if len(content) < 100:
+            print(f"  ⚠️  Content too short, skipping\n")
             skipped += 1
+        else:
+            print(f"  ✅ Fetched\n")
+            pending.append((title, content, url))
+        
+        if len(pending) >= STORE_BATCH_SIZE:
+            if model is None:
+                model = load_embedding_model()
+            successful += store_in_database(pending, model, source='microsoft')
+            pending = []
         
         # Be respectful to Microsoft servers
         time.sleep(3)
     
+    if pending:
+        if model is None:
+            model = load_embedding_model()
+        successful += store_in_database(pending, model, source='microsoft')
+    
     print("="*70)
     print(f"  COMPLETE!")
     print(f"  ✅ Successfully added: {successful}")
@@ -219,20 +212,12 @@ def main():
     print("="*70)
     
     # Show final counts
-    conn = psycopg2.connect(
-        host=os.getenv('DB_HOST'),
-        database=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        port=os.getenv('DB_PORT')
-    )
-    cur = conn.cursor()
-    cur.execute("SELECT source, COUNT(*) FROM sql_docs GROUP BY source")
-    print("\nDatabase contents:")
-    for source, count in cur.fetchall():
-        print(f"  {source}: {count} documents")
-    cur.close()
-    conn.close()
+    with db.cursor() as cur:
+        cur.execute("SELECT source, COUNT(*) FROM sql_docs GROUP BY source")
+        print("\nDatabase contents:")
+        for source, count in cur.fetchall():
+            print(f"  {source}: {count} documents")
+    print(db.format_pool_stats())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,15 +1,15 @@
-import psycopg2
-from pgvector.psycopg2 import register_vector
-from sentence_transformers import SentenceTransformer
-import os
 from dotenv import load_dotenv
+import db
+from embeddings import get_model
 
 load_dotenv()
 
-# Load model
-print("Loading embedding model...")
-model = SentenceTransformer('all-MiniLM-L6-v2')
-print("✅ Model loaded\n")
+def load_embedding_model():
+    """Loaded only when there is something new to embed (reruns with nothing new skip torch entirely)"""
+    print("Loading embedding model...")
+    model = get_model()
+    print("✅ Model loaded\n")
+    return model
 
 # Mock Runbooks and Documentation
 MOCK_RUNBOOKS = [
@@ -1239,46 +1239,28 @@ Quarterly DR drills:
     }
 ]
 
-def store_runbook(runbook_data):
-    """Store runbook in database"""
+def store_runbooks(runbooks):
+    """Store new runbooks in one batch; returns the URLs that were stored"""
     
-    conn = psycopg2.connect(
-        host=os.getenv('DB_HOST'),
-        database=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        port=os.getenv('DB_PORT')
-    )
-    register_vector(conn)
-    cur = conn.cursor()
+    with db.cursor() as cur:
+        # Check which already exist
+        existing = db.existing_urls(cur, [r['url'] for r in runbooks])
+        new_runbooks = [r for r in runbooks if r['url'] not in existing]
+        if not new_runbooks:
+            return set()
     
-    # Check if exists
-    cur.execute("SELECT id FROM sql_docs WHERE url = %s", (runbook_data['url'],))
-    if cur.fetchone():
-        cur.close()
-        conn.close()
-        return False
+        # Generate embeddings in one batch (numpy arrays, sent as binary vectors)
+        texts = [f"{r['title']} {r['description']}" for r in new_runbooks]
+        embeddings = load_embedding_model().encode(texts, batch_size=32)
     
-    # Generate embedding
-    text = f"{runbook_data['title']} {runbook_data['description']}"
-    embedding = model.encode(text).tolist()
+        # Insert with binary COPY; created_at takes the column default (now)
+        db.copy_rows(cur, 'sql_docs', ('title', 'content', 'url', 'embedding', 'source'), [
+            (r['title'], r['description'], r['url'], embedding, 'documentation')  # New source type
+            for r, embedding in zip(new_runbooks, embeddings)
+        ])
+        db.notify_docs_changed(cur, 'documentation')
     
-    # Insert
-    cur.execute("""
-        INSERT INTO sql_docs (title, content, url, embedding, source, created_at)
-        VALUES (%s, %s, %s, %s, %s, NOW())
-    """, (
-        runbook_data['title'],
-        runbook_data['description'],
-        runbook_data['url'],
-        embedding,
-        'documentation'  # New source type
-    ))
-    
-    conn.commit()
-    cur.close()
-    conn.close()
-    return True
+    return {r['url'] for r in new_runbooks}
 
 def main():
     print("="*70)
@@ -1289,13 +1271,15 @@ def main():
     successful = 0
     skipped = 0
     
+    stored = store_runbooks(MOCK_RUNBOOKS)
+    
     for runbook in MOCK_RUNBOOKS:
         doc_id = runbook['doc_id']
         title = runbook['title'][:60] + "..."
         print(f"Processing: {doc_id}")
         print(f"  {title}")
         
-        if store_runbook(runbook):
+        if runbook['url'] in stored:
             print(f"  ✅ Stored\n")
             successful += 1
         else:
@@ -1308,20 +1292,12 @@ def main():
     print("="*70)
     
     # Show final counts
-    conn = psycopg2.connect(
-        host=os.getenv('DB_HOST'),
-        database=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        port=os.getenv('DB_PORT')
-    )
-    cur = conn.cursor()
-    cur.execute("SELECT source, COUNT(*) FROM sql_docs GROUP BY source ORDER BY source")
-    print("\nDatabase contents:")
-    for source, count in cur.fetchall():
-        print(f"  {source}: {count} documents")
-    cur.close()
-    conn.close()
+    with db.cursor() as cur:
+        cur.execute("SELECT source, COUNT(*) FROM sql_docs GROUP BY source ORDER BY source")
+        print("\nDatabase contents:")
+        for source, count in cur.fetchall():
+            print(f"  {source}: {count} documents")
+    print(db.format_pool_stats())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
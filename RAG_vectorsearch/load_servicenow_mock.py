@@ -1,15 +1,16 @@
-import psycopg2
-from pgvector.psycopg2 import register_vector
-from sentence_transformers import SentenceTransformer
-import os
+from datetime import datetime
 from dotenv import load_dotenv
+import db
+from embeddings import get_model
 
 load_dotenv()
 
-# Load model
-print("Loading embedding model...")
-model = SentenceTransformer('all-MiniLM-L6-v2')
-print("✅ Model loaded\n")
+def load_embedding_model():
+    """Loaded only when there is something new to embed (reruns with nothing new skip torch entirely)"""
+    print("Loading embedding model...")
+    model = get_model()
+    print("✅ Model loaded\n")
+    return model
 
 # Mock ServiceNow incidents (realistic DBA scenarios)
 MOCK_INCIDENTS = [
@@ -638,47 +639,29 @@ Related Incidents: INC0007890 (corruption on SQLPROD02)
     },
 ]
 
-def store_incident(incident_data):
-    """Store incident/problem in database"""
+def store_incidents(incidents):
+    """Store new incidents/problems in one batch; returns the URLs that were stored"""
     
-    conn = psycopg2.connect(
-        host=os.getenv('DB_HOST'),
-        database=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        port=os.getenv('DB_PORT')
-    )
-    register_vector(conn)
-    cur = conn.cursor()
+    with db.cursor() as cur:
+        # Check which already exist
+        existing = db.existing_urls(cur, [i['url'] for i in incidents])
+        new_incidents = [i for i in incidents if i['url'] not in existing]
+        if not new_incidents:
+            return set()
     
-    # Check if exists
-    cur.execute("SELECT id FROM sql_docs WHERE url = %s", (incident_data['url'],))
-    if cur.fetchone():
-        cur.close()
-        conn.close()
-        return False
+        # Generate embeddings in one batch (numpy arrays, sent as binary vectors)
+        texts = [f"{i['title']} {i['description']}" for i in new_incidents]
+        embeddings = load_embedding_model().encode(texts, batch_size=32)
     
-    # Generate embedding
-    text = f"{incident_data['title']} {incident_data['description']}"
-    embedding = model.encode(text).tolist()
+        # Insert with binary COPY
+        db.copy_rows(cur, 'sql_docs', ('title', 'content', 'url', 'embedding', 'source', 'created_at'), [
+            (i['title'], i['description'], i['url'], embedding, 'servicenow',
+             datetime.strptime(i['resolved_date'], '%Y-%m-%d'))
+            for i, embedding in zip(new_incidents, embeddings)
+        ])
+        db.notify_docs_changed(cur, 'servicenow')
     
-    # Insert
-    cur.execute("""
-        INSERT INTO sql_docs (title, content, url, embedding, source, created_at)
-        VALUES (%s, %s, %s, %s, %s, %s)
-    """, (
-        incident_data['title'],
-        incident_data['description'],
-        incident_data['url'],
-        embedding,
-        'servicenow',
-        incident_data['resolved_date']
-    ))
-    
-    conn.commit()
-    cur.close()
-    conn.close()
-    return True
+    return {i['url'] for i in new_incidents}
 
 def main():
     print("="*70)
@@ -689,13 +672,15 @@ def main():
     successful = 0
     skipped = 0
     
+    stored = store_incidents(MOCK_INCIDENTS)
+    
     for incident in MOCK_INCIDENTS:
         number = incident['number']
         title = incident['title'][:50] + "..."
         print(f"Processing: {number}")
         print(f"  {title}")
         
-        if store_incident(incident):
+        if incident['url'] in stored:
             print(f"  ✅ Stored\n")
             successful += 1
         else:
@@ -708,20 +693,12 @@ def main():
     print("="*70)
     
     # Show final counts
-    conn = psycopg2.connect(
-        host=os.getenv('DB_HOST'),
-        database=os.getenv('DB_NAME'),
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD'),
-        port=os.getenv('DB_PORT')
-    )
-    cur = conn.cursor()
-    cur.execute("SELECT source, COUNT(*) FROM sql_docs GROUP BY source ORDER BY source")
-    print("\nDatabase contents:")
-    for source, count in cur.fetchall():
-        print(f"  {source}: {count} documents")
-    cur.close()
-    conn.close()
+    with db.cursor() as cur:
+        cur.execute("SELECT source, COUNT(*) FROM sql_docs GROUP BY source ORDER BY source")
+        print("\nDatabase contents:")
+        for source, count in cur.fetchall():
+            print(f"  {source}: {count} documents")
+    print(db.format_pool_stats())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,235 @@
+# Concurrent end-to-end load test: N simulated users asking questions through search_docs -> stream_claude
+#
+#   python loadtest.py --users 1 5 10 20 --duration 60
+#   python loadtest.py --users 25 --profile slow --error-rate 0.02 --output load_report.json
+#
+# Runs offline: answers come from llm_stub.py (started in-process unless --llm-url points at one
+# already running), models load from the local Hugging Face cache only, and the database must be
+# local (--allow-remote-db to override). Each user loops over the labeled questions from
+# evaluate.py with a think time between them, and reads the answer as a stream like the web UI. Per
+# user count it reports throughput, search / time-to-first-token / LLM / end-to-end latency percentiles,
+# error rates by type, and how saturated the DB pool was.
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from dotenv import load_dotenv
+import answer_cache
+import db
+from embeddings import encode_query, get_model
+from evaluate import labeled_queries, percentile
+from llm import create_client, stream_claude
+from llm_stub import PROFILES, StubConfig, serve
+from retrieval import search_docs
+from timing import trace
+
+load_dotenv()
+
+LOCAL_HOSTS = {None, '', 'localhost', '127.0.0.1', '::1'}
+POOL_SAMPLE_SECONDS = 0.05
+
+
+class PoolMonitor:
+    """Samples connections in use while a load level runs"""
+
+    def __init__(self):
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='pool-monitor', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(POOL_SAMPLE_SECONDS):
+            stats = db.pool_stats()
+            if stats:
+                self.samples.append((stats['in_use'], stats['max_size']))
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self):
+        if not self.samples:
+            return {'max_in_use': 0, 'mean_in_use': 0.0, 'saturated_fraction': 0.0}
+        return {
+            'max_in_use': max(in_use for in_use, _ in self.samples),
+            'mean_in_use': round(sum(in_use for in_use, _ in self.samples) / len(self.samples), 2),
+            'saturated_fraction': round(sum(in_use >= size for in_use, size in self.samples) / len(self.samples), 3),
+        }
+
+
+def ask(question, client, model):
+    """One user request as the web UI serves it, answer streamed; returns (search_ms, first_token_ms, llm_ms)"""
+    with trace('loadtest', question=question):
+        started = time.perf_counter()
+        results = search_docs(question, model=model)
+        searched = first_token = time.perf_counter()
+        for chunk, _ in enumerate(stream_claude(client, question, results, encode_query(model, question), model)):
+            if chunk == 0:
+                first_token = time.perf_counter()
+        finished = time.perf_counter()
+    return (searched - started) * 1000, (first_token - searched) * 1000, (finished - searched) * 1000
+
+
+def run_level(users, args, questions, client, model):
+    deadline = time.perf_counter() + args.ramp_up + args.duration
+    lock = threading.Lock()
+    samples = []
+    errors = Counter()
+
+    def user(index):
+        rng = random.Random(args.seed + index)
+        time.sleep(args.ramp_up * index / users)  # spread user arrivals over the ramp-up
+        while time.perf_counter() < deadline:
+            question = rng.choice(questions)
+            started = time.perf_counter()
+            try:
+                search_ms, first_token_ms, llm_ms = ask(question, client, model)
+            except Exception as e:
+                with lock:
+                    errors[type(e).__name__] += 1
+            else:
+                with lock:
+                    samples.append((started, search_ms, first_token_ms, llm_ms, (time.perf_counter() - started) * 1000))
+            if args.think_ms:
+                time.sleep(rng.expovariate(1000.0 / args.think_ms))
+
+    pool_before = db.pool_stats()
+    threads = [threading.Thread(target=user, args=(i,), name=f'user-{i}') for i in range(users)]
+    with PoolMonitor() as monitor:
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    pool_after = db.pool_stats()
+
+    # Throughput and latency over the steady state only (requests started after the ramp-up)
+    steady = [s for s in samples if s[0] >= started + args.ramp_up] or samples
+    failed = sum(errors.values())
+    attempted = len(samples) + failed
+
+    def latency(values):
+        if not values:
+            return {}
+        return {'p50_ms': round(percentile(values, 50), 1), 'p95_ms': round(percentile(values, 95), 1),
+                'p99_ms': round(percentile(values, 99), 1), 'max_ms': round(max(values), 1)}
+
+    return {
+        'users': users,
+        'elapsed_s': round(elapsed, 2),
+        'requests': len(samples),
+        'throughput_rps': round(len(steady) / args.duration, 3) if args.duration else 0.0,
+        'error_rate': round(failed / attempted, 4) if attempted else 0.0,
+        'errors': dict(errors),
+        'latency': {
+            'search': latency([s[1] for s in steady]),
+            'first_token': latency([s[2] for s in steady]),
+            'llm': latency([s[3] for s in steady]),
+            'total': latency([s[4] for s in steady]),
+        },
+        'pool': dict(monitor.summary(),
+                     size=pool_after.get('max_size'),
+                     p95_wait_ms=round(pool_after.get('p95_wait_ms', 0.0), 2),
+                     timeouts=pool_after.get('timeouts', 0) - pool_before.get('timeouts', 0)),
+    }
+
+
+def start_stub(args):
+    config = StubConfig.from_profile(args.profile, first_token_ms=args.first_token_ms,
+                                     tokens_per_sec=args.tokens_per_sec, error_rate=args.error_rate)
+    server = serve('127.0.0.1', 0, config)
+    threading.Thread(target=server.serve_forever, name='llm-stub', daemon=True).start()
+    return server, config
+
+
+def print_level(result):
+    total, search, first_token, llm = (result['latency'][name] for name in ('total', 'search', 'first_token', 'llm'))
+    pool = result['pool']
+    print(f"{result['users']:>6}{result['throughput_rps']:>9.2f}{total.get('p50_ms', 0):>10.0f}"
+          f"{total.get('p95_ms', 0):>10.0f}{total.get('p99_ms', 0):>10.0f}{search.get('p95_ms', 0):>11.0f}"
+          f"{first_token.get('p95_ms', 0):>10.0f}{llm.get('p95_ms', 0):>9.0f}{result['error_rate']:>8.1%}"
+          f"{pool['max_in_use']:>6}/{pool['size']:<3}{pool['saturated_fraction']:>7.0%}{pool['p95_wait_ms']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent search_docs -> stream_claude load test (offline)")
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 5, 10, 20], help="concurrent users per level")
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds per level after the ramp-up")
+    parser.add_argument('--ramp-up', type=float, default=5.0, help="seconds over which users start")
+    parser.add_argument('--think-ms', type=float, default=1000.0, help="mean pause between a user's questions")
+    parser.add_argument('--profile', choices=list(PROFILES), default='default', help="llm_stub latency profile")
+    parser.add_argument('--first-token-ms', type=float)
+    parser.add_argument('--tokens-per-sec', type=float)
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of LLM calls failing with 529")
+    parser.add_argument('--llm-url', help="use an llm_stub.py that is already running instead of starting one")
+    parser.add_argument('--answer-cache', action='store_true', help="keep the answer cache on (off by default)")
+    parser.add_argument('--allow-remote-db', action='store_true')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', help="write the report as JSON")
+    args = parser.parse_args()
+
+    # Nothing may leave the host: models from the local cache (sentence_transformers is imported
+    # on first use, after this), Claude from the stub
+    os.environ['HF_HUB_OFFLINE'] = '1'
+    os.environ['TRANSFORMERS_OFFLINE'] = '1'
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'stub')
+
+    host = db.connection_params()['host']
+    if host not in LOCAL_HOSTS and not host.startswith('/') and not args.allow_remote_db:
+        parser.error(f"DB_HOST={host} is not local; pass --allow-remote-db to load test it anyway")
+
+    stub = stub_config = None
+    if args.llm_url:
+        os.environ['ANTHROPIC_BASE_URL'] = args.llm_url
+    else:
+        stub, stub_config = start_stub(args)
+        os.environ['ANTHROPIC_BASE_URL'] = f"http://127.0.0.1:{stub.server_address[1]}"
+    # Repeated questions would otherwise be answered from the cache after the first round
+    answer_cache.ANSWER_CACHE_ENABLED = args.answer_cache
+
+    questions = [question for _, question, _ in labeled_queries()]
+    model = get_model()
+    client = create_client()
+    ask(questions[0], client, model)  # warm up models, pool and prepared statements
+
+    print(f"{len(questions)} questions, {args.duration:.0f} s per level, think time {args.think_ms:.0f} ms, "
+          f"LLM {os.environ['ANTHROPIC_BASE_URL']} ({args.profile}), DB pool max {db.POOL_MAX_CONN}\n")
+    print(f"{'users':>6}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'search p95':>11}"
+          f"{'ttft p95':>10}{'llm p95':>9}{'errors':>8}{'pool':>10}{'full':>7}{'wait p95':>10}")
+    levels = []
+    for users in args.users:
+        result = run_level(users, args, questions, client, model)
+        levels.append(result)
+        print_level(result)
+        if result['errors']:
+            print(f"{'':>6}errors: {', '.join(f'{name} x{count}' for name, count in result['errors'].items())}")
+
+    if stub_config is not None:
+        stats = stub_config.stats()
+        print(f"\nLLM stub: {stats['requests']} requests (including SDK retries), {stats['errors']} failed, "
+              f"peak {stats['peak_active']} concurrent")
+        stub.shutdown()
+
+    if args.output:
+        report = {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'config': {key: value for key, value in vars(args).items() if key != 'output'},
+            'pool_max': db.POOL_MAX_CONN,
+            'levels': levels,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
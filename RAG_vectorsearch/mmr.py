@@ -0,0 +1,76 @@
+# Maximal marginal relevance (MMR) diversification of search results
+#
+# Trades relevance against redundancy: each pick maximizes
+#   lambda * relevance - (1 - lambda) * max similarity to the results already picked
+# The candidate-to-candidate similarities come from one matrix product over the embeddings
+# returned with the results (hybrid_search(with_embeddings=True)).
+from collections import Counter
+import numpy as np
+import os
+from dotenv import load_dotenv
+from timing import span
+
+load_dotenv()
+
+MMR_LAMBDA = float(os.getenv('MMR_LAMBDA', '0.7'))
+MMR_MIN_PER_SOURCE = int(os.getenv('MMR_MIN_PER_SOURCE', '1'))
+MMR_CANDIDATES = int(os.getenv('MMR_CANDIDATES', '25'))
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def mmr_select(results, limit, lambda_=MMR_LAMBDA, min_per_source=MMR_MIN_PER_SOURCE):
+    """Pick `limit` results by MMR, relevance being each result's fused score (`similarity`)
+
+    `min_per_source` reserves slots so every source among the candidates gets at least
+    that many results (as far as the limit allows); 0 turns the quota off.
+    Results without an embedding are treated as unrelated to everything else.
+    """
+    if len(results) <= 1 or limit <= 0:
+        return list(results[:limit])
+
+    with span('mmr', candidates=len(results), limit=limit):
+        return _select(results, limit, lambda_, min_per_source)
+
+
+def _select(results, limit, lambda_, min_per_source):
+
+    dimensions = next((len(r.embedding) for r in results if r.embedding is not None), 0)
+    embeddings = np.zeros((len(results), dimensions), dtype=np.float32)
+    for index, r in enumerate(results):
+        if r.embedding is not None:
+            embeddings[index] = r.embedding
+    embeddings = normalize_rows(embeddings)
+    pairwise = embeddings @ embeddings.T
+
+    relevance = np.array([r.similarity for r in results], dtype=np.float32)
+    spread = relevance.max() - relevance.min()
+    relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones_like(relevance)
+
+    sources = np.array([r.source for r in results], dtype=object)
+    quota = {source: min(min_per_source, count) for source, count in Counter(sources).items()}
+
+    available = np.ones(len(results), dtype=bool)
+    max_similarity = np.full(len(results), -np.inf, dtype=np.float32)
+    selected = []
+    while len(selected) < min(limit, len(results)):
+        redundancy = np.where(np.isfinite(max_similarity), max_similarity, 0.0)
+        scores = lambda_ * relevance - (1 - lambda_) * redundancy
+
+        candidates = available
+        owed = {source: count for source, count in quota.items() if count > 0}
+        if owed and sum(owed.values()) >= limit - len(selected):
+            # Remaining slots are all spoken for: only sources still below their minimum compete
+            candidates = available & np.isin(sources, list(owed))
+        pick = int(np.argmax(np.where(candidates, scores, -np.inf)))
+
+        selected.append(pick)
+        available[pick] = False
+        max_similarity = np.maximum(max_similarity, pairwise[pick])
+        if sources[pick] in quota:
+            quota[sources[pick]] -= 1
+
+    return [results[index] for index in selected]
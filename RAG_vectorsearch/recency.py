@@ -0,0 +1,51 @@
+# Recency-aware ranking: time decay of hybrid search scores, per source
+#
+# A document's fused score is multiplied by
+#   min_weight + (1 - min_weight) * 0.5 ^ (age in days / half-life of its source)
+# so an incident loses half of its decayable weight every half-life, while a highly relevant old
+# RCA keeps at least `min_weight` of its score. Sources without a half-life are not decayed.
+#
+#   RECENCY_HALF_LIFE_DAYS=servicenow=180,documentation=730
+#
+# Ages are measured against created_at (resolved_date for ServiceNow incidents) inside the
+# retrieval SQL, which also adds each decayed source's most recent documents to the semantic
+# candidates (read through idx_sql_docs_source_created_at), so last week's incident competes
+# even when older near-duplicates fill the HNSW top-k.
+import os
+from dotenv import load_dotenv
+from fusion import parse_weights
+
+load_dotenv()
+
+RECENCY_HALF_LIFE_DAYS = parse_weights(os.getenv('RECENCY_HALF_LIFE_DAYS', ''))
+RECENCY_MIN_WEIGHT = float(os.getenv('RECENCY_MIN_WEIGHT', '0.5'))
+RECENCY_RECENT_ROWS = int(os.getenv('RECENCY_RECENT_ROWS', '500'))  # newest rows per query scored exactly
+
+
+class RecencyDecay:
+    def __init__(self, half_lives=None, min_weight=RECENCY_MIN_WEIGHT, recent_rows=RECENCY_RECENT_ROWS):
+        half_lives = RECENCY_HALF_LIFE_DAYS if half_lives is None else half_lives
+        self.half_lives = {source: days for source, days in half_lives.items() if days > 0}
+        self.min_weight = min_weight
+        self.recent_rows = recent_rows
+
+    def signature(self):
+        return tuple(sorted(self.half_lives.items())), self.min_weight
+
+    def half_life_table(self):
+        """A (source, half_life) relation and its parameters"""
+        sources = sorted(self.half_lives)
+        return ("SELECT unnest(%s::text[]) AS source, unnest(%s::float[]) AS half_life",
+                [sources, [float(self.half_lives[source]) for source in sources]])
+
+    def sql_factor(self, alias='d', half_life_alias='h'):
+        """Decay multiplier for a row joined (LEFT) to the half-life table; 1.0 for other sources"""
+        age_days = f"GREATEST(extract(epoch FROM now()::timestamp - {alias}.created_at) / 86400.0, 0)"
+        return (f"COALESCE(%s::float + (1 - %s::float) * power(0.5, {age_days} / {half_life_alias}.half_life), 1.0)",
+                [self.min_weight, self.min_weight])
+
+
+def get_recency(half_lives=None, **kwargs):
+    """Decay from RECENCY_HALF_LIFE_DAYS (or `half_lives`), or None when no source decays"""
+    decay = RecencyDecay(half_lives, **kwargs)
+    return decay if decay.half_lives else None
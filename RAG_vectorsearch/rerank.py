@@ -0,0 +1,89 @@
+# Optional cross-encoder rerank stage for hybrid search results
+#
+# Scores (question, title + snippet) pairs with a small cross-encoder in one batched CPU call.
+# The stage is skipped when the predicted scoring time would exceed RERANK_BUDGET_MS.
+import threading
+import time
+import os
+from dotenv import load_dotenv
+from timing import span
+
+load_dotenv()
+
+RERANK_ENABLED = os.getenv('RERANK_ENABLED', 'false').lower() == 'true'
+RERANK_MODEL = os.getenv('RERANK_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+RERANK_CANDIDATES = int(os.getenv('RERANK_CANDIDATES', '20'))
+RERANK_BUDGET_MS = float(os.getenv('RERANK_BUDGET_MS', '250'))
+RERANK_SNIPPET_CHARS = int(os.getenv('RERANK_SNIPPET_CHARS', '512'))
+PROBE_EVERY = 20  # re-measure after this many consecutive skips, in case the host got faster
+
+
+class Reranker:
+    """Lazily loaded CrossEncoder with a moving estimate of its per-pair latency"""
+
+    def __init__(self, model_name=RERANK_MODEL, candidates=RERANK_CANDIDATES, budget_ms=RERANK_BUDGET_MS):
+        self.model_name = model_name
+        self.candidates = candidates
+        self.budget_ms = budget_ms
+        self._model = None
+        self._lock = threading.Lock()
+        self.ms_per_pair = None  # exponential moving average, None until the first scored batch
+        self.runs = 0
+        self.skips = 0
+        self._skipped_in_a_row = 0
+
+    def load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, device='cpu')
+        return self._model
+
+    def predicted_ms(self, pairs):
+        return None if self.ms_per_pair is None else self.ms_per_pair * pairs
+
+    def rerank(self, query, results, limit=None):
+        """Reorder `results` by cross-encoder score; returns (results, info)
+
+        Results need a title and (snippet) content. Candidates beyond `self.candidates`
+        keep their fused order after the reranked ones.
+        """
+        candidates = results[:self.candidates]
+        predicted = self.predicted_ms(len(candidates))
+        over_budget = predicted is not None and predicted > self.budget_ms
+        if not candidates or (over_budget and self._skipped_in_a_row < PROBE_EVERY):
+            self.skips += 1
+            self._skipped_in_a_row += 1
+            return results[:limit] if limit else results, {'skipped': True, 'predicted_ms': predicted}
+
+        model = self.load()
+        pairs = [(query, f"{r.title}\n{r.content or ''}") for r in candidates]
+        started = time.perf_counter()
+        with span('rerank', pairs=len(pairs)):
+            scores = model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        per_pair = elapsed_ms / len(pairs)
+        self.ms_per_pair = per_pair if self.ms_per_pair is None else 0.8 * self.ms_per_pair + 0.2 * per_pair
+        self.runs += 1
+        self._skipped_in_a_row = 0
+
+        reranked = sorted(
+            (r._replace(similarity=float(score), method=f"{r.method}+rerank") for r, score in zip(candidates, scores)),
+            key=lambda r: r.similarity, reverse=True
+        ) + list(results[self.candidates:])
+        return reranked[:limit] if limit else reranked, {'skipped': False, 'elapsed_ms': elapsed_ms}
+
+
+_reranker = None
+
+
+def get_reranker():
+    """Process-wide reranker, or None when RERANK_ENABLED is off"""
+    global _reranker
+    if not RERANK_ENABLED:
+        return None
+    if _reranker is None:
+        _reranker = Reranker()
+    return _reranker
@@ -0,0 +1,157 @@
+# Search result cache, invalidated when a loader changes sql_docs
+#
+# Loaders send NOTIFY on db.DOCS_CHANGED_CHANNEL (payload = source) in the same transaction
+# as their inserts. A listener thread drops the affected entries as soon as that commits.
+# Entries are only served while the listener is connected, so a missed notification
+# can never surface stale results.
+import select
+import threading
+import time
+from collections import OrderedDict
+import psycopg2
+import os
+from dotenv import load_dotenv
+import db
+from embeddings import normalize_query
+from timing import logger
+
+load_dotenv()
+
+SEARCH_CACHE_TTL = float(os.getenv('SEARCH_CACHE_TTL', '300'))
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', '256'))
+LISTEN_RECONNECT_DELAY = 5
+
+
+class ResultCache:
+    """TTL-bounded LRU of search results keyed by normalized query and search parameters"""
+
+    def __init__(self, ttl=SEARCH_CACHE_TTL, maxsize=SEARCH_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.listening = False
+        self.generation = 0  # bumped on every invalidation, see put()
+        self._entries = OrderedDict()  # key -> (expires_at, sources, results)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(query, limit, filters=None, fusion=None, reranker=None, per_source=0, recency=None):
+        """Everything that changes search_docs' results: `reranker` and `recency` as resolved (None when
+        off), `per_source` the number of documents each source is guaranteed (0 when off)"""
+        filter_key = None
+        if filters is not None:
+            filter_key = (tuple(sorted(filters.sources or ())), filters.created_after, filters.created_before)
+        fusion_key = fusion.signature() if fusion is not None else None
+        reranker_key = (reranker.model_name, reranker.candidates) if reranker is not None else None
+        recency_key = recency.signature() if recency is not None else None
+        return normalize_query(query), limit, filter_key, fusion_key, reranker_key, per_source, recency_key
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key) if self.listening else None
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, results, sources=None, generation=None):
+        """Store results computed while `generation` was current.
+
+        `sources` is the source filter of the search (None = every source). Results are
+        dropped if an invalidation arrived while they were being computed.
+        """
+        with self._lock:
+            if not self.listening or (generation is not None and generation != self.generation):
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, frozenset(sources) if sources else None, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, source=None):
+        """Drop entries that could include documents from `source` (all entries when None)"""
+        with self._lock:
+            stale = [key for key, (_, sources, _) in self._entries.items()
+                     if source is None or sources is None or source in sources]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+            self.generation += 1
+
+    def set_listening(self, listening):
+        with self._lock:
+            self.listening = listening
+            self.generation += 1
+            self._entries.clear()  # anything cached before (re)connecting may have missed a NOTIFY
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'listening': self.listening,
+            }
+
+
+class InvalidationListener(threading.Thread):
+    """Background LISTEN on a dedicated (non-pooled) connection"""
+
+    def __init__(self, cache):
+        super().__init__(name='result-cache-listener', daemon=True)
+        self.cache = cache
+
+    def run(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**db.connection_params())
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {db.DOCS_CHANGED_CHANNEL}")
+                self.cache.set_listening(True)
+
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self.cache.invalidate(notify.payload or None)
+            except (psycopg2.Error, OSError) as e:
+                logger.warning("Result cache listener disconnected (%s); retrying in %ss", e, LISTEN_RECONNECT_DELAY,
+                               exc_info=True)
+            finally:
+                self.cache.set_listening(False)
+                if conn is not None:
+                    conn.close()
+            time.sleep(LISTEN_RECONNECT_DELAY)
+
+
+result_cache = ResultCache()
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def start_listener():
+    """Start the invalidation listener once per process; results are not cached until it connects"""
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = InvalidationListener(result_cache)
+            _listener.start()
+    return result_cache
+
+
+def format_cache_stats(stats=None):
+    stats = result_cache.stats() if stats is None else stats
+    state = "listening" if stats['listening'] else "disabled (no LISTEN connection)"
+    return (f"Search result cache: {stats['hits']} hits / {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%}), {stats['size']} entries, "
+            f"{stats['invalidations']} invalidated, {state}")
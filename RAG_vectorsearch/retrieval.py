@@ -0,0 +1,572 @@
+# Shared retrieval queries and search pipelines for the web UI, the CLI agent, evaluation and benchmarks
+import base64
+import json
+import os
+import re
+from collections import namedtuple
+from datetime import datetime
+from dotenv import load_dotenv
+import db
+from embeddings import encode_query, get_model
+from fusion import get_fusion
+from mmr import MMR_CANDIDATES, MMR_MIN_PER_SOURCE, mmr_select
+from recency import get_recency
+from rerank import RERANK_SNIPPET_CHARS, get_reranker
+from timing import logger, span
+
+load_dotenv()
+
+# How filtered HNSW queries are run:
+#   iterative - pgvector >= 0.8 iterative index scans (falls back to overfetch on older servers)
+#   overfetch - widen hnsw.ef_search so enough rows survive the WHERE clause
+#   plain     - no tuning, the filter is applied to the default ef_search candidates
+FILTER_STRATEGY = os.getenv('VECTOR_FILTER_STRATEGY', 'iterative')
+HNSW_MAX_SCAN_TUPLES = int(os.getenv('HNSW_MAX_SCAN_TUPLES', '20000'))
+HNSW_OVERFETCH_FACTOR = int(os.getenv('HNSW_OVERFETCH_FACTOR', '40'))
+HNSW_MAX_EF_SEARCH = 1000  # pgvector's upper bound for hnsw.ef_search
+
+# Queries per statement in search_many (one VALUES list of vectors each)
+SEARCH_MANY_CHUNK = int(os.getenv('SEARCH_MANY_CHUNK', '50'))
+
+# search_docs fills MMR's per-source quota (MMR_MIN_PER_SOURCE) from a per-source top-k query,
+# so every source is represented among the candidates even when none of its documents ranks globally
+PER_SOURCE_RETRIEVAL = os.getenv('PER_SOURCE_RETRIEVAL', 'true').lower() == 'true'
+# Without iterative scans (pgvector < 0.8) the per-source scans are best-effort: a source with no row in
+# the ef_search window gets nothing. PER_SOURCE_EXACT=true scores every row of every source instead
+PER_SOURCE_EXACT = os.getenv('PER_SOURCE_EXACT', 'false').lower() == 'true'
+
+# Retrievers computed by hybrid_search; each exposes <name>_rank and <name>_score to the fusion
+RETRIEVERS = ('semantic', 'keyword')
+
+SearchFilters = namedtuple('SearchFilters', ['sources', 'created_after', 'created_before'],
+                           defaults=(None, None, None))
+
+# `embedding` is only filled in when a caller asks for it (hybrid_search(with_embeddings=True))
+SearchResult = namedtuple('SearchResult', ['title', 'content', 'url', 'source', 'similarity', 'id', 'method',
+                                           'embedding'], defaults=(None,))
+
+# One page of keyset-paginated rows; `cursor` resumes after its last row (None on the last page)
+Page = namedtuple('Page', ['results', 'cursor'])
+
+STOP_WORDS = {'any', 'the', 'and', 'or', 'have', 'we', 'seen', 'about', 'with', 'for', 'from', 'recently', 'latest', 'show', 'me', 'get', 'find', 'how', 'many', 'what', 'when', 'where', 'why', 'is', 'are', 'be', 'been', 'do', 'does', 'dont', 'can', 'could', 'should', 'would', 'may', 'might', 'must', 'will', 'shall', 'in', 'on', 'at', 'to', 'by', 'as', 'of', 'if', 'that', 'this', 'it', 'it\'s', 'you', 'we', 'they', 'them', 'their', 'your', 'our'}
+
+_FILTER_TOKEN = re.compile(r'\b(source|after|before):(\S+)', re.IGNORECASE)
+
+_pgvector_version = None
+
+
+def parse_filters(text):
+    """Split inline filters (source:servicenow after:2024-10-01 before:2024-12-31) out of a query"""
+    sources = []
+    created_after = None
+    created_before = None
+
+    for key, value in _FILTER_TOKEN.findall(text):
+        key = key.lower()
+        if key == 'source':
+            sources.extend(s for s in value.lower().split(',') if s)
+            continue
+        try:
+            when = datetime.strptime(value, '%Y-%m-%d')
+        except ValueError:
+            continue  # unparseable dates are dropped rather than failing the search
+        if key == 'after':
+            created_after = when
+        else:
+            created_before = when
+
+    query = ' '.join(_FILTER_TOKEN.sub('', text).split())
+    return query, SearchFilters(sources or None, created_after, created_before)
+
+
+def extract_keywords(query):
+    """Keywords for the ILIKE search - preserve technical terms, drop stop words"""
+    keywords = query.lower().split()
+    return [k.strip('?,;:.!') for k in keywords if k.strip('?,;:.!') not in STOP_WORDS and len(k) > 2]
+
+
+def has_filters(filters):
+    return filters is not None and any(value is not None for value in filters)
+
+
+def filter_clause(filters, alias=''):
+    """Build a WHERE fragment and its parameters for the given filters"""
+    if not has_filters(filters):
+        return 'TRUE', []
+
+    prefix = f"{alias}." if alias else ''
+    conditions = []
+    params = []
+    if filters.sources:
+        conditions.append(f"{prefix}source = ANY(%s::text[])")
+        params.append(list(filters.sources))
+    if filters.created_after is not None:
+        conditions.append(f"{prefix}created_at >= %s")
+        params.append(filters.created_after)
+    if filters.created_before is not None:
+        conditions.append(f"{prefix}created_at < %s")
+        params.append(filters.created_before)
+    return ' AND '.join(conditions), params
+
+
+def pgvector_version(cur):
+    """Installed pgvector extension version as a tuple, cached per process"""
+    global _pgvector_version
+    if _pgvector_version is None:
+        cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        row = cur.fetchone()
+        _pgvector_version = tuple(int(part) for part in re.findall(r'\d+', row[0])) if row else (0,)
+    return _pgvector_version
+
+
+def filtered_scan_strategy(cur, strategy=None):
+    """The strategy configure_filtered_scan applies: iterative falls back to overfetch before pgvector 0.8"""
+    strategy = strategy or FILTER_STRATEGY
+    if strategy == 'iterative' and pgvector_version(cur) < (0, 8, 0):
+        return 'overfetch'
+    return strategy
+
+
+def exact_order(distance_sql):
+    """ORDER BY expression the planner cannot serve from the HNSW index (+ 0), so the rows are scored exactly
+
+    For queries that must not lose rows to a fixed ef_search window when iterative scans are unavailable.
+    """
+    return f"({distance_sql}) + 0"
+
+
+def configure_filtered_scan(cur, limit, strategy=None, order='relaxed'):
+    """Tune the HNSW scan for the current transaction so a filtered query still fills `limit` rows
+
+    `order='strict'` keeps iterative scans in exact distance order (needed across keyset pages).
+    """
+    strategy = filtered_scan_strategy(cur, strategy)
+
+    if strategy == 'iterative':
+        # relaxed_order keeps scanning the graph until enough rows pass the filter;
+        # callers re-sort the (slightly out of order) rows by distance
+        cur.execute(f"SET LOCAL hnsw.iterative_scan = {'strict' if order == 'strict' else 'relaxed'}_order")
+        cur.execute("SET LOCAL hnsw.max_scan_tuples = %s", (HNSW_MAX_SCAN_TUPLES,))
+    elif strategy == 'overfetch':
+        ef_search = min(HNSW_MAX_EF_SEARCH, max(40, limit * HNSW_OVERFETCH_FACTOR))
+        cur.execute("SET LOCAL hnsw.ef_search = %s", (ef_search,))
+
+    return strategy
+
+
+def content_column(content_chars, alias='d'):
+    """Select full content (None), a server-side truncated snippet (N chars) or nothing (0)"""
+    if content_chars is None:
+        return f"{alias}.content"
+    if content_chars <= 0:
+        return "NULL::text"
+    return f"left({alias}.content, {int(content_chars)})"
+
+
+def fetch_content(cur, results, content_chars=None):
+    """Second phase of a late fetch: load content (or snippets) only for the results actually used"""
+    if not results:
+        return results
+    with span('db.fetch_content', rows=len(results)):
+        db.execute_prepared(cur, f"SELECT d.id, {content_column(content_chars)} FROM sql_docs d "
+                                 f"WHERE d.id = ANY(%s::integer[])", ([r.id for r in results],))
+        content_by_id = dict(cur.fetchall())
+    return [r._replace(content=content_by_id.get(r.id)) for r in results]
+
+
+def semantic_search(cur, query_embedding, limit, filters=None, strategy=None, content_chars=0):
+    """Nearest documents by cosine distance, optionally restricted by source and created_at
+
+    Returns ids, titles, urls and scores; content is left out unless `content_chars` asks for it.
+    """
+    where, filter_params = filter_clause(filters)
+    if has_filters(filters):
+        configure_filtered_scan(cur, limit, strategy)
+
+    # MATERIALIZED keeps the index scan inside the CTE; the outer ORDER BY
+    # restores exact distance order after a relaxed iterative scan. The vector is bound once
+    # and its distance reused; the statement is prepared once per connection (db.execute_prepared)
+    with span('db.semantic_search', limit=limit, filtered=has_filters(filters)) as fields:
+        db.execute_prepared(cur, f'''
+            WITH candidates AS MATERIALIZED (
+                SELECT id, embedding <=> %s::vector AS distance
+                FROM sql_docs
+                WHERE {where}
+                ORDER BY distance
+                LIMIT %s
+            )
+            SELECT d.title, {content_column(content_chars)}, d.url, d.source, 1 - c.distance, d.id
+            FROM candidates c
+            JOIN sql_docs d ON d.id = c.id
+            ORDER BY c.distance
+        ''', [query_embedding] + filter_params + [limit])
+
+        results = [SearchResult(title, content, url, source, float(similarity), doc_id, 'semantic')
+                   for title, content, url, source, similarity, doc_id in cur.fetchall()]
+        fields['rows'] = len(results)
+    return results
+
+
+def encode_cursor(values):
+    """Opaque token for a keyset position, safe in URLs and agent tool inputs"""
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    return json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+
+
+def semantic_search_page(cur, query_embedding, limit, filters=None, cursor=None, content_chars=0, exclude_ids=None):
+    """One page of nearest documents, keyset-paginated on (distance, id)
+
+    Pass the previous Page.cursor to continue, and `exclude_ids` to skip documents the caller already
+    shows. Earlier rows are excluded by the WHERE clause rather than fetched and discarded (OFFSET), so
+    every page sends and sorts only `limit` rows; the HNSW scan still walks past the earlier neighbours,
+    in strict distance order so no row falls between pages. Without iterative scans (pgvector < 0.8,
+    or the overfetch / plain strategies) a fixed ef_search window would run dry a few pages in, so
+    filtered and later pages are scored exactly instead, and the first page raises ef_search above
+    `limit` so it is never cut short.
+    """
+    where, filter_params = filter_clause(filters)
+    after, after_params = 'TRUE', []
+    if cursor is not None:
+        after = '(embedding <=> %s::vector, id) > (%s::float8, %s::integer)'
+        after_params = [query_embedding, cursor[0], cursor[1]]
+    excluded, exclude_params = 'TRUE', []
+    if exclude_ids:
+        excluded, exclude_params = 'id <> ALL(%s::integer[])', [list(exclude_ids)]
+    order_by = 'distance'
+    if filtered_scan_strategy(cur) == 'iterative':
+        configure_filtered_scan(cur, limit, order='strict')
+    elif has_filters(filters) or cursor is not None or exclude_ids or limit + 1 > HNSW_MAX_EF_SEARCH:
+        order_by = exact_order('embedding <=> %s::vector')
+    else:
+        # Unfiltered first page: the index returns at most ef_search rows, and a short page means "no more"
+        cur.execute("SET LOCAL hnsw.ef_search = %s", (max(40, limit + 1),))
+
+    with span('db.semantic_search_page', limit=limit, filtered=has_filters(filters),
+              paged=cursor is not None, exact=order_by != 'distance') as fields:
+        db.execute_prepared(cur, f'''
+            WITH candidates AS MATERIALIZED (
+                SELECT id, embedding <=> %s::vector AS distance
+                FROM sql_docs
+                WHERE {where} AND {after} AND {excluded}
+                ORDER BY {order_by}
+                LIMIT %s
+            )
+            SELECT d.title, {content_column(content_chars)}, d.url, d.source, c.distance, d.id
+            FROM candidates c
+            JOIN sql_docs d ON d.id = c.id
+            ORDER BY c.distance, c.id
+        ''', [query_embedding] + filter_params + after_params + exclude_params
+            + ([query_embedding] if order_by != 'distance' else []) + [limit + 1])  # one extra row: next page?
+        rows = cur.fetchall()
+        fields['rows'] = min(len(rows), limit)
+
+    results = [SearchResult(title, content, url, source, 1 - float(distance), doc_id, 'semantic')
+               for title, content, url, source, distance, doc_id in rows[:limit]]
+    next_cursor = (float(rows[limit - 1][4]), rows[limit - 1][5]) if len(rows) > limit else None
+    return Page(results, next_cursor)
+
+
+def recency_fragments(recency, where, filter_params, query_embedding, semantic_limit):
+    """CTEs, candidate union and score factor hybrid_search adds for time decay (recency.py)"""
+    if recency is None:
+        return '', [], 'SELECT id, distance FROM semantic_candidates', '', '1.0', []
+
+    table_sql, table_params = recency.half_life_table()
+    factor_sql, factor_params = recency.sql_factor('r', 'h')
+    # The newest rows of each decayed source, read in created_at order from
+    # idx_sql_docs_source_created_at and scored exactly, join the HNSW candidates
+    ctes = f'''
+            half_lives AS ({table_sql}),
+            recent_candidates AS MATERIALIZED (
+                SELECT n.id, n.embedding <=> %s::vector AS distance
+                FROM half_lives h
+                CROSS JOIN LATERAL (
+                    SELECT id, embedding
+                    FROM sql_docs
+                    WHERE source = h.source AND {where}
+                    ORDER BY created_at DESC NULLS LAST
+                    LIMIT %s
+                ) n
+                ORDER BY distance
+                LIMIT %s
+            ),'''
+    params = table_params + [query_embedding] + filter_params + [recency.recent_rows, semantic_limit]
+    candidates = ('SELECT id, distance FROM semantic_candidates '
+                  'UNION SELECT id, distance FROM recent_candidates')
+    joins = '''
+                JOIN sql_docs r ON r.id = f.id
+                LEFT JOIN half_lives h ON h.source = r.source'''
+    return ctes, params, candidates, joins, factor_sql, factor_params
+
+
+def hybrid_search(cur, query_embedding, keywords, limit=6, filters=None,
+                  semantic_limit=10, keyword_limit=15, fusion=None, content_chars=None, with_embeddings=False,
+                  recency=None):
+    """Semantic + keyword retrieval and fusion in a single statement
+
+    Both retrievers rank their own candidates (cosine distance, share of keywords matched)
+    and `fusion` (see fusion.py) combines the ranks into one score. The candidate CTEs
+    carry ids and scores only; content is read for the returned rows, in full, as a
+    `content_chars` snippet, or not at all (0, see fetch_content). `with_embeddings`
+    also returns each row's vector, for diversification (mmr.py). `recency` (default from
+    RECENCY_HALF_LIFE_DAYS, False for none) decays the fused score by document age (recency.py).
+    """
+    fusion = fusion or get_fusion()
+    score_sql, score_params = fusion.sql_score(RETRIEVERS)
+    recency = get_recency() if recency is None else recency or None
+
+    where, filter_params = filter_clause(filters)
+    if has_filters(filters):
+        configure_filtered_scan(cur, semantic_limit)
+
+    patterns = [f'%{keyword}%' for keyword in keywords[:3]]
+    embedding_column = 'd.embedding' if with_embeddings else 'NULL::vector'
+    recency_ctes, recency_params, semantic_rows, recency_joins, decay_sql, decay_params = recency_fragments(
+        recency, where, filter_params, query_embedding, semantic_limit)
+
+    # Fusion runs inside this statement, so its cost is part of the db.hybrid_search span
+    with span('db.hybrid_search', limit=limit, fusion=fusion.name, filtered=has_filters(filters),
+              recency=recency is not None) as fields:
+        db.execute_prepared(cur, f'''
+            WITH semantic_candidates AS MATERIALIZED (
+                SELECT id, embedding <=> %s::vector AS distance
+                FROM sql_docs
+                WHERE {where}
+                ORDER BY distance
+                LIMIT %s
+            ),{recency_ctes}
+            semantic AS (
+                SELECT id, 1 - distance AS semantic_score,
+                       ROW_NUMBER() OVER (ORDER BY distance, id) AS semantic_rank
+                FROM ({semantic_rows}) c
+            ),
+            keyword_candidates AS (
+                SELECT id,
+                       (SELECT COUNT(*) FROM unnest(%s::text[]) p
+                        WHERE title ILIKE p OR content ILIKE p)::float / %s AS keyword_score
+                FROM sql_docs
+                WHERE (title ILIKE ANY(%s::text[]) OR content ILIKE ANY(%s::text[])) AND {where}
+            ),
+            keyword AS (
+                SELECT id, keyword_score,
+                       ROW_NUMBER() OVER (ORDER BY keyword_score DESC, id) AS keyword_rank
+                FROM keyword_candidates
+                ORDER BY keyword_rank
+                LIMIT %s
+            ),
+            fused AS (
+                SELECT COALESCE(s.id, k.id) AS id,
+                       s.semantic_rank, s.semantic_score, k.keyword_rank, k.keyword_score,
+                       CASE WHEN k.id IS NULL THEN 'semantic'
+                            WHEN s.id IS NULL THEN 'keyword'
+                            ELSE 'keyword-match' END AS method
+                FROM semantic s
+                FULL OUTER JOIN keyword k ON k.id = s.id
+            ),
+            top AS (
+                SELECT f.id, f.method, ({score_sql}) * {decay_sql} AS score
+                FROM fused f{recency_joins}
+                ORDER BY score DESC, f.id
+                LIMIT %s
+            )
+            SELECT d.title, {content_column(content_chars)}, d.url, d.source, t.score, d.id, t.method,
+                   {embedding_column}
+            FROM top t
+            JOIN sql_docs d ON d.id = t.id
+            ORDER BY t.score DESC, t.id
+        ''', [query_embedding] + filter_params + [semantic_limit] + recency_params
+              + [patterns, max(len(patterns), 1), patterns, patterns] + filter_params + [keyword_limit]
+              + score_params + decay_params + [limit])
+
+        results = [SearchResult(title, content, url, source, float(score), doc_id, method, embedding)
+                   for title, content, url, source, score, doc_id, method, embedding in cur.fetchall()]
+        fields['rows'] = len(results)
+    return results
+
+
+def per_source_search(cur, query_embedding, per_source, filters=None, content_chars=0, with_embeddings=False):
+    """The `per_source` nearest documents of every source, in one statement
+
+    The distinct sources come from a loose index scan over idx_source (one probe per source) unless
+    the filters name them; each source then gets its own HNSW scan through a LATERAL join, an iterative
+    scan so small sources still fill their quota. Without iterative scans the scans widen ef_search
+    (overfetch) and the quota is best-effort: a small source may have no row in that window. With
+    PER_SOURCE_EXACT they skip the index and compute the distance of every row of every source instead.
+    Rows are ordered by distance.
+    """
+    where, filter_params = filter_clause(filters)
+    order_by = 'distance'
+    strategy = filtered_scan_strategy(cur)
+    if strategy != 'iterative' and PER_SOURCE_EXACT:
+        order_by = exact_order('embedding <=> q.embedding')
+    else:
+        configure_filtered_scan(cur, per_source, strategy if strategy == 'iterative' else 'overfetch')
+
+    if filters is not None and filters.sources:
+        sources_sql = "SELECT unnest(%s::text[]) AS source"
+        source_params = [list(filters.sources)]
+    else:
+        sources_sql = '''
+            SELECT min(source) AS source FROM sql_docs
+            UNION ALL
+            SELECT (SELECT min(d.source) FROM sql_docs d WHERE d.source > s.source)
+            FROM sources s
+            WHERE s.source IS NOT NULL'''
+        source_params = []
+    embedding_column = 'd.embedding' if with_embeddings else 'NULL::vector'
+
+    with span('db.per_source_search', per_source=per_source, filtered=has_filters(filters),
+              exact=order_by != 'distance') as fields:
+        db.execute_prepared(cur, f'''
+            WITH RECURSIVE sources AS ({sources_sql}),
+            query AS (SELECT %s::vector AS embedding)
+            SELECT d.title, {content_column(content_chars)}, d.url, d.source, 1 - c.distance, d.id,
+                   {embedding_column}
+            FROM sources s
+            CROSS JOIN query q
+            CROSS JOIN LATERAL (
+                SELECT id, embedding <=> q.embedding AS distance
+                FROM sql_docs
+                WHERE source = s.source AND {where}
+                ORDER BY {order_by}
+                LIMIT %s
+            ) c
+            JOIN sql_docs d ON d.id = c.id
+            WHERE s.source IS NOT NULL
+            ORDER BY c.distance, d.id
+        ''', source_params + [query_embedding] + filter_params + [per_source])
+
+        results = [SearchResult(title, content, url, source, float(similarity), doc_id, 'semantic-source', embedding)
+                   for title, content, url, source, similarity, doc_id, embedding in cur.fetchall()]
+        fields['rows'] = len(results)
+    return results
+
+
+def add_source_quota(candidates, per_source_results):
+    """Append per-source results missing from `candidates`, ranked below every candidate
+
+    They carry a cosine similarity rather than a fused or rerank score, so they enter MMR with the
+    lowest relevance: MMR only picks them to meet a source's quota.
+    """
+    seen = {r.id for r in candidates}
+    floor = min((r.similarity for r in candidates), default=0.0)
+    extra = [r._replace(similarity=floor) for r in per_source_results if r.id not in seen]
+    return list(candidates) + extra
+
+
+def semantic_search_many(cur, query_embeddings, limit, filters=None, content_chars=0):
+    """Nearest documents for several query vectors in one statement; one result list per query
+
+    Each vector in the VALUES list drives its own index scan through a LATERAL join, so a batch costs
+    one roundtrip and one plan instead of one per query. The statement text depends on the batch
+    size, so it is executed directly rather than prepared.
+    """
+    if len(query_embeddings) == 0:
+        return []
+
+    where, filter_params = filter_clause(filters)
+    if has_filters(filters):
+        configure_filtered_scan(cur, limit)
+
+    values = ', '.join(['(%s, %s::vector)'] * len(query_embeddings))
+    value_params = [param for index, embedding in enumerate(query_embeddings) for param in (index, embedding)]
+
+    with span('db.semantic_search_many', queries=len(query_embeddings), limit=limit) as fields:
+        cur.execute(f'''
+            SELECT q.query_index, d.title, {content_column(content_chars)}, d.url, d.source, 1 - c.distance, d.id
+            FROM (VALUES {values}) AS q(query_index, embedding)
+            CROSS JOIN LATERAL (
+                SELECT id, embedding <=> q.embedding AS distance
+                FROM sql_docs
+                WHERE {where}
+                ORDER BY distance
+                LIMIT %s
+            ) c
+            JOIN sql_docs d ON d.id = c.id
+            ORDER BY q.query_index, c.distance
+        ''', value_params + filter_params + [limit])
+
+        results = [[] for _ in query_embeddings]
+        for index, title, content, url, source, similarity, doc_id in cur.fetchall():
+            results[index].append(SearchResult(title, content, url, source, float(similarity), doc_id, 'semantic'))
+        fields['rows'] = sum(len(r) for r in results)
+    return results
+
+
+def search_many(queries, limit=6, filters=None, content_chars=0, chunk_size=SEARCH_MANY_CHUNK, model=None):
+    """Semantic search for many queries: yields (query, results) in input order as each chunk completes
+
+    All queries are encoded in one batched call, then looked up `chunk_size` at a time with
+    semantic_search_many. A pooled connection is held until the generator is exhausted or closed.
+    """
+    queries = list(queries)
+    if not queries:
+        return
+
+    model = model or get_model()
+    with span('embed_batch', texts=len(queries)):
+        query_embeddings = model.encode(queries, batch_size=64)
+
+    with db.cursor() as cur:
+        for start in range(0, len(queries), chunk_size):
+            chunk = semantic_search_many(cur, query_embeddings[start:start + chunk_size], limit, filters,
+                                         content_chars)
+            for offset, results in enumerate(chunk):
+                yield queries[start + offset], results
+
+
+def search_docs(query, limit=6, filters=None, fusion=None, model=None, cache=None, reranker=None, per_source=None,
+                recency=None):
+    """Web UI search: hybrid retrieval fused server-side in one query, optional rerank, then MMR
+
+    `cache` is a result_cache.ResultCache (None to always search). `reranker` defaults to the
+    configured one (RERANK_ENABLED); pass False to turn reranking off, or a Reranker to force it.
+    `per_source` (default PER_SOURCE_RETRIEVAL) adds each source's nearest documents for MMR's quota;
+    `recency` is passed to hybrid_search.
+    """
+    fusion = fusion or get_fusion()
+    reranker = get_reranker() if reranker is None else reranker or None
+    per_source = PER_SOURCE_RETRIEVAL if per_source is None else per_source
+    source_quota = MMR_MIN_PER_SOURCE if per_source else 0
+    recency = get_recency() if recency is None else recency or None
+    if cache is not None:
+        cache_key = cache.make_key(query, limit, filters, fusion, reranker, source_quota, recency)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            logger.debug("Result cache hit: %s", query)
+            return cached
+        generation = cache.generation
+
+    keywords = extract_keywords(query)
+    logger.debug("Query: %s, keywords: %s", query, keywords)
+
+    query_embedding = encode_query(model or get_model(), query)
+
+    # Wider candidate list with embeddings for MMR (and short snippets for the cross-encoder),
+    # then keep the `limit` most relevant, least redundant results
+    candidate_count = max(limit, MMR_CANDIDATES, reranker.candidates if reranker else 0)
+    with db.cursor() as cur:
+        candidates = hybrid_search(cur, query_embedding, keywords, candidate_count, filters, fusion=fusion,
+                                   content_chars=RERANK_SNIPPET_CHARS if reranker else 0, with_embeddings=True,
+                                   recency=recency or False)
+        source_results = (per_source_search(cur, query_embedding, source_quota, filters, with_embeddings=True)
+                          if source_quota > 0 else [])
+    if reranker is not None:
+        candidates, info = reranker.rerank(query, candidates)
+        logger.debug("Rerank: %s", info)
+        if not info['skipped']:
+            candidates = candidates[:reranker.candidates]  # keep cross-encoder scores on one scale for MMR
+    candidates = add_source_quota(candidates, source_results)
+    # Metadata and scores only: content is fetched when a prompt is built (not on answer cache hits)
+    results = [r._replace(content=None, embedding=None) for r in mmr_select(candidates, limit)]
+
+    logger.debug("Final results count: %s", len(results))
+    for r in results:
+        logger.debug("  - %s: %s... (%.2f, %s)", r.source, r.title[:50], r.similarity, r.method)
+
+    if cache is not None:
+        cache.put(cache_key, results, filters.sources if filters else None, generation)
+    return results
@@ -3,6 +3,7 @@ import psycopg2
 from pgvector.psycopg2 import register_vector
 import os
 from dotenv import load_dotenv
+import answer_cache
 
 load_dotenv()
 
@@ -53,6 +54,15 @@ def setup_ai_learning():
     # Enable pgvector extension
     cur.execute('CREATE EXTENSION IF NOT EXISTS vector')
 
+    # Trigram indexes serve the ILIKE keyword matches (hybrid search, aggregate questions); optional,
+    # without pg_trgm (contrib not installed, or no privilege) those matches fall back to scanning
+    try:
+        cur.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        trigram = True
+    except psycopg2.Error as e:
+        print(f"⚠️  pg_trgm unavailable, skipping the trigram indexes ({e.pgerror or e})")
+        trigram = False
+
     # Register vector type
     register_vector(conn)
 
@@ -84,6 +94,36 @@ def setup_ai_learning():
             TABLESPACE pg_default;
     ''')
 
+    # Newest documents per source first: recency-aware ranking reads recent incidents in this order (see recency.py)
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sql_docs_source_created_at
+            ON public.sql_docs USING btree
+            (source COLLATE pg_catalog."default" ASC NULLS LAST, created_at DESC NULLS LAST)
+            TABLESPACE pg_default;
+    ''')
+
+    # Newest documents first, keyset-paginated on (created_at, id) by the agent's list_recent
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sql_docs_created_at
+            ON public.sql_docs USING btree
+            (created_at DESC NULLS LAST, id DESC)
+            TABLESPACE pg_default;
+    ''')
+
+    if trigram:
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sql_docs_title_trgm
+                ON public.sql_docs USING gin
+                (title gin_trgm_ops)
+                TABLESPACE pg_default;
+        ''')
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sql_docs_content_trgm
+                ON public.sql_docs USING gin
+                (content gin_trgm_ops)
+                TABLESPACE pg_default;
+        ''')
+
     # Create vector index for similarity search
     cur.execute('''
         CREATE INDEX IF NOT EXISTS sql_docs_embedding_idx
@@ -92,6 +132,9 @@ def setup_ai_learning():
             TABLESPACE pg_default;
     ''')
 
+    # Persistent semantic cache of Claude answers, defined once in answer_cache.py
+    cur.execute(answer_cache.CREATE_TABLE_SQL)
+
     print("✅ ai_learning database, table, and indexes are set up!")
     cur.close()
     conn.close()
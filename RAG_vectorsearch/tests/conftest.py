@@ -0,0 +1,67 @@
+# Database tests run against the database in .env (DB_*), inside a throwaway schema (rag_test)
+# that is dropped afterwards; they are skipped when no database answers.
+import os
+import sys
+from contextlib import contextmanager
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TEST_SCHEMA = 'rag_test'
+
+
+@pytest.fixture
+def conn():
+    """Connection with search_path on an empty rag_test.sql_docs (3-dimensional embeddings)"""
+    psycopg2 = pytest.importorskip('psycopg2')
+    from pgvector.psycopg2 import register_vector
+    import db
+
+    try:
+        conn = psycopg2.connect(**db.connection_params())
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"no test database: {e}")
+    cur = conn.cursor()
+    cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    cur.execute(f"DROP SCHEMA IF EXISTS {TEST_SCHEMA} CASCADE")
+    cur.execute(f"CREATE SCHEMA {TEST_SCHEMA}")
+    cur.execute(f"""
+        CREATE TABLE {TEST_SCHEMA}.sql_docs (
+            id serial PRIMARY KEY,
+            title text NOT NULL,
+            content text NOT NULL,
+            url text,
+            embedding vector(3),
+            created_at timestamp,
+            source varchar(50) DEFAULT 'blog'
+        )
+    """)
+    cur.execute(f"SET search_path = {TEST_SCHEMA}, public")
+    conn.commit()
+    register_vector(conn)
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+        cur = conn.cursor()
+        cur.execute(f"DROP SCHEMA IF EXISTS {TEST_SCHEMA} CASCADE")
+        conn.commit()
+        conn.close()
+
+
+@pytest.fixture
+def pooled_cursor(conn, monkeypatch):
+    """Route db.cursor() (the pool) to the test connection"""
+    import db
+
+    @contextmanager
+    def cursor():
+        cur = conn.cursor()
+        try:
+            yield cur
+            conn.commit()
+        finally:
+            cur.close()
+
+    monkeypatch.setattr(db, 'cursor', cursor)
+    return cursor
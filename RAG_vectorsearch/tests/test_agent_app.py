@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+import pytest
+import agent_app
+from retrieval import decode_cursor, encode_cursor
+
+DATED = 7
+UNDATED = 5
+
+
+def insert_posts(conn):
+    cur = conn.cursor()
+    start = datetime(2024, 1, 1)
+    for i in range(DATED):
+        cur.execute("INSERT INTO sql_docs (title, content, created_at) VALUES (%s, '', %s)",
+                    (f"dated {i}", start + timedelta(days=i)))
+    for i in range(UNDATED):
+        cur.execute("INSERT INTO sql_docs (title, content, created_at) VALUES (%s, '', NULL)", (f"undated {i}",))
+    conn.commit()
+
+
+@pytest.mark.parametrize('limit', [3, 4, DATED, DATED + UNDATED + 1])
+def test_recent_posts_pages_from_dated_into_undated_rows(conn, pooled_cursor, limit):
+    insert_posts(conn)
+
+    rows = []
+    cursor = None
+    while True:
+        page = agent_app.recent_posts(limit, cursor)
+        assert len(page.results) <= limit
+        rows += page.results
+        if page.cursor is None:
+            break
+        cursor = decode_cursor(encode_cursor(page.cursor))  # as list_recent hands it to the agent and back
+
+    assert len(rows) == DATED + UNDATED
+    assert len({row[3] for row in rows}) == DATED + UNDATED
+    dates = [row[2] for row in rows]
+    assert dates[:DATED] == sorted(dates[:DATED], reverse=True)
+    assert dates[DATED:] == [None] * UNDATED
+    undated_ids = [row[3] for row in rows[DATED:]]
+    assert undated_ids == sorted(undated_ids, reverse=True)
+
+
+def test_list_recent_follows_more_token_into_undated_rows(conn, pooled_cursor):
+    insert_posts(conn)
+
+    answer = agent_app.list_recent(str(DATED + 1))
+    token = answer.rsplit("list_recent with '", 1)[1].split("'")[0]
+    answer = agent_app.list_recent(token)
+
+    assert answer.startswith(f"Next {UNDATED - 1} posts")
+    assert "Date: unknown" in answer
@@ -0,0 +1,24 @@
+from benchmark import eager_heavy_modules, parse_import_times
+
+IMPORTTIME_STDERR = """\
+import time: self [us] | cumulative | imported package
+import time:       310 |        310 |       torch._C
+import time:      9000 |       9310 |     torch
+import time:       800 |      10110 |   sentence_transformers
+import time:       150 |      10260 | embeddings
+import time:        40 |         40 | timing
+"""
+
+
+def test_parse_import_times_keeps_nested_modules_with_their_depth():
+    times = parse_import_times(IMPORTTIME_STDERR)
+
+    assert times['embeddings'] == (10260, 0)
+    assert times['timing'] == (40, 0)
+    assert times['sentence_transformers'] == (10110, 1)
+    assert times['torch'] == (9310, 2)
+    assert times['torch._C'] == (310, 3)
+
+
+def test_nested_heavy_imports_are_reported():
+    assert eager_heavy_modules(parse_import_times(IMPORTTIME_STDERR)) == ['torch', 'sentence_transformers']
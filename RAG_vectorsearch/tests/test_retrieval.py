@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+import retrieval
+from retrieval import semantic_search_page
+
+ROWS = 377
+PAGE = 50  # above pgvector's default hnsw.ef_search of 40
+
+
+def insert_documents(conn, rows=ROWS):
+    rng = np.random.default_rng(7)
+    cur = conn.cursor()
+    cur.executemany("INSERT INTO sql_docs (title, content, embedding) VALUES (%s, '', %s)",
+                    [(f"doc {i}", rng.random(3).astype(np.float32)) for i in range(rows)])
+    cur.execute("CREATE INDEX ON sql_docs USING hnsw (embedding vector_cosine_ops)")
+    cur.execute("ANALYZE sql_docs")
+    conn.commit()
+
+
+@pytest.mark.parametrize('strategy', ['iterative', 'overfetch', 'plain'])
+def test_semantic_search_page_pages_through_every_row_when_limit_exceeds_ef_search(conn, monkeypatch, strategy):
+    insert_documents(conn)
+    monkeypatch.setattr(retrieval, 'FILTER_STRATEGY', strategy)
+    cur = conn.cursor()
+    cur.execute("SET enable_seqscan = off")  # plan as on a large table: through the HNSW index
+    conn.commit()
+    query = np.array([0.3, 0.5, 0.2], dtype=np.float32)
+
+    ids = []
+    distances = []
+    cursor = None
+    while True:
+        page = semantic_search_page(cur, query, PAGE, cursor=cursor)
+        conn.commit()  # each page is its own transaction, as in the web UI
+        assert len(page.results) == PAGE or page.cursor is None
+        ids += [r.id for r in page.results]
+        distances += [1 - r.similarity for r in page.results]
+        if page.cursor is None:
+            break
+        cursor = page.cursor
+
+    assert len(ids) == ROWS
+    assert len(set(ids)) == ROWS
+    assert distances == sorted(distances)
@@ -0,0 +1,78 @@
+# Per-request latency spans and structured logging
+#
+#   with trace('question', question=prompt) as request_trace:
+#       with span('embed'):
+#           ...
+#   request_trace.spans  ->  [{'name': 'embed', 'ms': 4.1, ...}, ...]
+#
+# Spans attach to the trace that is active in the current context (a contextvar, so
+# concurrent Streamlit sessions don't mix). Every span is logged at DEBUG, and the
+# finished trace as one JSON line at INFO. Outside a trace, spans are only logged.
+import contextvars
+import json
+import logging
+import time
+import os
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+logger = logging.getLogger('rag')
+
+_current_trace = contextvars.ContextVar('rag_trace', default=None)
+
+
+def configure_logging(level=None):
+    """Log to stderr at LOG_LEVEL (DEBUG shows queries, keywords and every span)"""
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    logger.setLevel(level or LOG_LEVEL)
+
+
+class Trace:
+    def __init__(self, name, **fields):
+        self.name = name
+        self.fields = fields
+        self.spans = []
+        self.started = time.perf_counter()
+        self.total_ms = None
+
+    def add(self, name, ms, **fields):
+        self.spans.append(dict(name=name, ms=round(ms, 2), **fields))
+
+    def as_dict(self):
+        return dict(trace=self.name, total_ms=self.total_ms, spans=self.spans, **self.fields)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def trace(name, **fields):
+    """Collect the spans of one request; the trace is logged when the block exits"""
+    request_trace = Trace(name, **fields)
+    token = _current_trace.set(request_trace)
+    try:
+        yield request_trace
+    finally:
+        _current_trace.reset(token)
+        request_trace.total_ms = round((time.perf_counter() - request_trace.started) * 1000, 2)
+        logger.info(json.dumps(request_trace.as_dict(), default=str))
+
+
+@contextmanager
+def span(name, **fields):
+    """Time a block; the yielded dict takes extra fields (row counts, cache hits, ...)"""
+    started = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        request_trace = _current_trace.get()
+        if request_trace is not None:
+            request_trace.add(name, elapsed_ms, **fields)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(dict(span=name, ms=round(elapsed_ms, 2), **fields), default=str))